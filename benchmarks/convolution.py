@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Times the 'average' filter's convolution on a million-row column for a range of window lengths
+
+    PYTHONPATH=python python benchmarks/convolution.py [--rows 1000000]
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.signal
+
+from cdplot.filters import choose_convolution_method, convolve
+
+WINDOW_LENGTHS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    arguments = parser.parse_args()
+
+    values = np.random.default_rng(0).normal(size=arguments.rows)
+    print(f"{'window':>8} {'method':>12} {'convolve':>10} {'scipy auto':>11} {'max error':>10}")
+
+    for length in WINDOW_LENGTHS:
+        window = np.full(length, 1 / length)
+        method = choose_convolution_method(len(values), length)
+
+        ours = best_time(lambda: convolve(values, window))
+        scipy_auto = best_time(lambda: scipy.signal.convolve(values, window))
+
+        exact = np.convolve(values, window)[(length - 1) // 2:][:len(values)]
+        error = np.max(np.abs(convolve(values, window) - exact))
+
+        print(f"{length:>8} {method:>12} {ours * 1000:>8.1f}ms {scipy_auto * 1000:>9.1f}ms {error:>10.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Times process_data on a config with many independent filters, for a range of thread counts
+
+    PYTHONPATH=python python benchmarks/filters.py [--rows 1000000] [--chains 12]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas
+
+from cdplot.columns import ColumnStore
+from cdplot.filters import OperatorFactory, Operation, process_data
+from cdplot.workers import available_cpus
+
+
+def make_operations(n_chains):
+    """ Smoothing, integrals and lfilters of different columns. None of them share any data """
+    factory = OperatorFactory()
+    config = dict(data=dict(exclude=[], _operations=[]), plot=dict(x='time'))
+    factory.operations = config['data']['_operations']
+
+    for index in range(n_chains):
+        source = f'pid {index}'
+        kind = index % 3
+        if kind == 0:
+            factory.add_operator(config, dict(source=source, destination=f'{source} smooth', type='average',
+                                              coefficients=2000), columns=None)
+        elif kind == 1:
+            factory.add_operator(config, dict(source=source, destination=f'{source} lti', type='lti',
+                                              coefficients=dict(numerator=[0.1, 0.2, 0.1],
+                                                                denominator=[1, -0.9, 0.2])), columns=None)
+        else:
+            factory.add_operator(config, dict(source=source, destination=f'{source} delta', type='difference',
+                                              align='right'), columns=None)
+            factory.add_operator(config, dict(source=f'{source} delta', destination=f'{source} sum',
+                                              type='accumulator'), columns=None)
+
+    return list(map(Operation, factory.operations))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chains', type=int, default=12)
+    parser.add_argument('--threads', type=int, nargs='*',
+                        help='thread counts to try. Defaults to powers of 2 up to the cpu count')
+    arguments = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dataframe = pandas.DataFrame({f'pid {index}': rng.normal(size=arguments.rows) for index in range(arguments.chains)})
+    operations = make_operations(arguments.chains)
+
+    cpus = available_cpus()
+    thread_counts = arguments.threads or sorted({1, cpus} | {n for n in (2, 4, 8, 16) if n <= cpus})
+    print(f"{len(operations)} operations on {arguments.rows} rows, {cpus} cpus")
+    if cpus == 1:
+        print("Only one cpu is available, so this can only show the overhead of the thread pool, not a speedup")
+
+    baseline = None
+    for workers in thread_counts:
+        times = []
+        for _ in range(3):
+            store = ColumnStore.from_dataframe(dataframe)
+            start = time.perf_counter()
+            process_data(store, operations, workers=workers)
+            times.append(time.perf_counter() - start)
+
+        baseline = baseline or min(times)
+        print(f"{workers:>3} threads: {min(times) * 1000:8.1f}ms  speedup {baseline / min(times):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
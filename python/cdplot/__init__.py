@@ -5,6 +5,9 @@ Package for plot_torque_pro
 
 __version__ = "1.0a"
 
+from cdplot.config import process_config
+from cdplot.dataset import Dataset, augment_data
+
 
 def get_version():
     """ Returns the package and build version of plot_torque_pro """
@@ -4,12 +4,19 @@ import sys
 from pathlib import Path
 
 from cdplot.data import load_from_csv
-from cdplot.filters import create_data_operators, process_data
-from cdplot.plot import render_plot
-from .config import process_config, serialize_config, determine_columns
+from cdplot.dataset import Dataset, augment_data
+from cdplot.export import export
+from cdplot.output import write_html
+from cdplot.overlay import overlay
+from cdplot.plot import mark_preview, render_plot
+from cdplot.summary import summarize
+from cdplot.watch import Watcher
+from .config import process_config, serialize_config
 
 logger = logging.getLogger('plot_torque_pro')
 
+DEFAULT_PREVIEW_ROWS = 10000
+
 
 def main():
     import argparse
@@ -28,35 +35,101 @@ def main():
     parser.add_argument('--dropna', '--drop-na', type=bool, help='pandas.read_csv dropna argument')
     parser.add_argument('--dropna-threshold', '--drop-na-threshold', type=bool, help='pandas.read_csv dropna_threshold argument')
     parser.add_argument('--fillna', '--fill-na', type=bool, help='pandas.read_csv fillna argument')
+    parser.add_argument('--cache-dir', type=Path, help='directory for keeping filter outputs between runs')
+    parser.add_argument('--cache-size-mb', type=float, help='maximum size of the cache directory')
+    parser.add_argument('--workers', type=int, help='number of threads for running filters')
+    parser.add_argument('--preview', type=int, nargs='?', const=DEFAULT_PREVIEW_ROWS,
+                        help=f'only plot a sample of about this many rows (default {DEFAULT_PREVIEW_ROWS}) from each csv')
+    parser.add_argument('--watch', action='store_true', help='keep running, and plot again when the config or csv change')
     # plot config parameters
     parser.add_argument('--x', '-x', help='column to use for the x-axis')
     parser.add_argument('--y', '-y', help='column(s) to use for the y-axis', nargs='*')
     parser.add_argument('--y2', help='column(s) to use for the right y axis', nargs='*')
+    parser.add_argument('--visible', nargs='*', help='column(s) to show at first. The rest start hidden in the legend')
+    parser.add_argument('--lazy-traces', action='store_true', default=None,
+                        help="write hidden traces to their own files, which are only loaded when they're shown")
+    parser.add_argument('--type', choices=['line', 'density'], help='line (the default), or density for a 2D histogram')
+    parser.add_argument('--bins', type=int, nargs='+', help='number of density bins, or x bins and y bins')
+    parser.add_argument('--log', action='store_true', default=None, help='colour density plots by log10 of the counts')
+    parser.add_argument('--z', help='colour density plots by an aggregate of this column instead of by the count')
+    parser.add_argument('--aggregate', choices=['sum', 'mean', 'min', 'max'], help='aggregate of --z for each bin')
+    # summary parameters
+    parser.add_argument('--summary', type=Path, help='write per-session statistics to this csv/parquet/feather file')
+    parser.add_argument('--summary-figure', type=Path, help='write an overview of the per-session statistics to html')
+    # export parameters
+    parser.add_argument('--export', type=Path, help='write the filtered data to this parquet/feather/arrow/npz/csv file '
+                                                    'instead of plotting it. {session} in it writes a file per session')
+    # overlay parameters
+    parser.add_argument('--overlay', help='plot this column for every session, aligned to the start of each session')
+    parser.add_argument('--align', help="'time' (the default), or a column to align sessions by, such as a distance")
+    parser.add_argument('--points', type=int, help='maximum number of points per session in an overlay')
     arguments = parser.parse_args()
     args_dict = dict(vars(arguments))
 
     # Filter out unset parameters
     args_dict = dict(filter(lambda k_v: k_v[1] is not None, args_dict.items()))
     config_path = args_dict.pop('config', None)
+    watch = args_dict.pop('watch', False)
+    summary_args = {key: args_dict.pop(arg) for arg, key in (('summary', 'output_path'),
+                                                             ('summary_figure', 'figure_path')) if arg in args_dict}
+    export_path = args_dict.pop('export', None)
+    overlay_args = {key: args_dict.pop(arg) for arg, key in (('overlay', 'y'), ('align', 'align'),
+                                                             ('points', 'points')) if arg in args_dict}
+
+    if watch:
+        Watcher(config_path, **args_dict).watch()
+        return
 
     config_dict = process_config(config_path, **args_dict)
+    if summary_args:
+        config_dict['summary'] = dict(config_dict.get('summary') or {}, **summary_args)
+    if export_path is not None:
+        config_dict['export'] = dict(config_dict.get('export') or {}, output_path=export_path)
+    if overlay_args:
+        config_dict['overlay'] = dict(config_dict.get('overlay') or {}, **overlay_args)
+
     try:
-        plot_data(config_dict)
+        if config_dict.get('summary'):
+            summarize(config_dict)
+        elif config_dict.get('export'):
+            export(config_dict)
+        elif config_dict.get('overlay'):
+            write_plot(overlay(config_dict), config_dict)
+        else:
+            plot_data(config_dict)
     except Exception:
         logger.error("Plotting failed. Here's the config\n%s", serialize_config(config_dict))
         raise
 
 
 def plot_data(config: dict):
+    if config.get('plots'):
+        plot_figures(config)
+        return
+
     csv_data = load_from_csv(config['data'])
     csv_data = augment_data(csv_data, config)
     plot_handle = render_plot(csv_data, config['plot'])
+    if config['data'].get('preview'):
+        mark_preview(plot_handle, config['data']['preview'])
 
     logger.debug("To reproduce this plot, put the following toml into its own config file\n%s",
                  serialize_config(config))
 
+    write_plot(plot_handle, config)
+
+
+def plot_figures(config):
+    """ Loads and filters the data once, and then writes a figure for each [[plot_torque_pro.plots]] section """
+    dataset = Dataset(config)
+    for figure_config, plot_handle in dataset.render_figures(workers=config['data'].get('workers')):
+        write_plot(plot_handle, figure_config)
+
+
+def write_plot(plot_handle, config):
+    """ Writes the figure to the configured output_path, or shows it if there isn't one """
     if config.get('output_path'):
-        plot_handle.write_html(config['output_path'])
+        write_html(plot_handle, config['output_path'], lazy=config.get('lazy_traces', False))
         logger.info("Written to %s", str(config['output_path']))
     else:
         plot_handle.show()
@@ -64,17 +137,6 @@ def plot_data(config: dict):
     logger.info("done")
 
 
-def augment_data(csv_data, config):
-    """ Augments or updates csv data with any operations specified in the config """
-    # Augment data as needed
-    operations = list(create_data_operators(config, list(csv_data.columns)))
-    process_data(csv_data, operations)
-
-    # Then truncate data as needed
-    plot_columns = determine_columns(list(csv_data.columns), config['data'])
-    return csv_data[plot_columns].copy()
-
-
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
     main()
@@ -0,0 +1,138 @@
+"""
+Keeps the outputs of filter operations on disk so that they don't need to be recomputed every run
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE_MB = 1024
+
+
+class OperationCache:
+    """
+    A directory of .npy files, one per operation output
+
+    Outputs are keyed by the operation's config and a fingerprint of each of its input columns, so an operation is only
+    skipped when it would have computed exactly the same thing. Cached outputs are memory-mapped rather than read, and
+    the least recently used outputs are deleted whenever the directory grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_SIZE_MB * 2**20):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_bytes = max_bytes
+        self._fingerprints = {}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, data_config):
+        """ Returns None unless caching has been turned on with plot_torque_pro.data.cache_dir """
+        if not data_config.get('cache_dir'):
+            return None
+
+        cache_size = data_config.get('cache_size_mb', DEFAULT_CACHE_SIZE_MB)
+        return cls(data_config['cache_dir'], max_bytes=int(cache_size * 2**20))
+
+    def key(self, operation, dataframe, producers):
+        """
+        Returns the cache key for operation
+
+        producers maps column names to the cache keys of the operations that produced them. Any other input column is
+        fingerprinted by its contents.
+        """
+        inputs = dict(producers)
+        for name in operation.inputs:
+            if name not in inputs:
+                inputs[name] = self.fingerprint(dataframe, name)
+
+        return hashlib.sha256(operation.key(inputs).encode()).hexdigest()
+
+    def fingerprint(self, dataframe, column):
+        if column not in self._fingerprints:
+            self._fingerprints[column] = fingerprint_column(dataframe[column])
+        return self._fingerprints[column]
+
+    def get(self, key):
+        """ Returns a read-only memory-mapped array, or None if key isn't cached """
+        path = self._path(key)
+        try:
+            values = np.load(path, mmap_mode='r', allow_pickle=False)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        # bump the modification time so that eviction is least-recently-used
+        os.utime(path)
+        return values
+
+    def put(self, key, values):
+        values = np.asarray(values)
+        if values.dtype.hasobject:
+            logger.debug("Not caching %s because its dtype is %s", key, values.dtype)
+            return
+
+        # write to a temporary file first so that a half-written file is never loaded
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as fh:
+                np.save(fh, values, allow_pickle=False)
+            os.replace(temp_path, self._path(key))
+        except PermissionError:
+            # on Windows a file that's memory-mapped can't be replaced. It holds the same output anyway
+            logger.debug("Not caching %s because it's in use", key)
+            Path(temp_path).unlink(missing_ok=True)
+            return
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used outputs until the cache fits in max_bytes. Outputs that are still in use (on
+        Windows, memory-mapped files can't be deleted) are skipped
+        """
+        entries = []
+        for path in self.cache_dir.glob('*.npy'):
+            try:
+                entries.append((path.stat(), path))
+            except OSError:
+                # deleted by another run since the glob
+                continue
+        total_bytes = sum(stat.st_size for stat, _ in entries)
+
+        for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug("Evicting %s from the cache", str(path))
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                logger.debug("Not evicting %s because it's in use", str(path))
+                continue
+            total_bytes -= stat.st_size
+
+    def _path(self, key):
+        return self.cache_dir / f'{key}.npy'
+
+
+def fingerprint_column(values):
+    """ Returns a hash of the column's dtype and contents. values can be a Series or a numpy array """
+    values = np.asarray(values)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([str(values.dtype), values.shape]).encode())
+
+    if values.dtype.hasobject:
+        digest.update(pandas.util.hash_array(values).tobytes())
+    else:
+        digest.update(np.ascontiguousarray(values).view(np.uint8))
+
+    return digest.hexdigest()
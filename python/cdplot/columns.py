@@ -0,0 +1,66 @@
+"""
+A light-weight column store used between the filters and the renderer
+"""
+import numpy as np
+import pandas
+
+
+class ColumnStore:
+    """
+    An ordered dictionary of 1-d numpy arrays that all have the same length
+
+    Unlike a DataFrame, adding a column never consolidates or copies the other columns, and selecting columns shares
+    the arrays instead of copying them. x is the name of the column that every plotted column is plotted against.
+    """
+
+    def __init__(self, columns=None, x=None):
+        self._columns = {}
+        self.x = x
+
+        for name, values in (columns or {}).items():
+            self[name] = values
+
+    @classmethod
+    def from_dataframe(cls, dataframe, x=None):
+        """ Wraps each column of dataframe. Columns are only copied if pandas can't hand out a numpy view of them """
+        return cls({name: dataframe[name] for name in dataframe.columns}, x=x)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @property
+    def x_values(self):
+        return self._columns[self.x]
+
+    def select(self, columns):
+        """ Returns a new ColumnStore with only the given columns. The arrays are shared, not copied """
+        return ColumnStore({name: self._columns[name] for name in columns}, x=self.x)
+
+    def to_dataframe(self):
+        return pandas.DataFrame(self._columns)
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __setitem__(self, name, values):
+        values = values.to_numpy() if isinstance(values, (pandas.Series, pandas.Index)) else np.asarray(values)
+        if values.ndim != 1:
+            raise ValueError(f"Column {name} must be 1-dimensional, not {values.ndim}-dimensional")
+        if self._columns and len(values) != len(self):
+            raise ValueError(f"Column {name} has {len(values)} rows, but other columns have {len(self)} rows")
+
+        self._columns[name] = values
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        """ Number of rows """
+        return len(next(iter(self._columns.values()))) if self._columns else 0
+
+    def __repr__(self):
+        return f'ColumnStore({len(self)} rows, columns={self.columns}, x={self.x!r})'
@@ -1,6 +1,7 @@
 """
 Handles reading config files and arguments to produce one config dictionary
 """
+import copy
 import datetime
 import fnmatch
 import logging
@@ -32,7 +33,6 @@ DEFAULT_CONFIG = {
         'read_csv': {
             'index_col': None,  # confusingly, None means don't parse an index column
             'skipinitialspace': True,
-            'parse_dates': True,
         },
     },
     'plot': {
@@ -41,6 +41,22 @@ DEFAULT_CONFIG = {
 }
 
 STRING_ARRAY_SCHEMA = {'type': 'array', 'items': {'type': 'string'}}
+PLOT_SCHEMA = dict(
+    x={'type': 'string'},
+    y=STRING_ARRAY_SCHEMA,
+    y2=STRING_ARRAY_SCHEMA,
+    type={'type': 'string', 'description': "'line' (the default) or 'density'"},
+    bins={'anyOf': [
+        {'type': 'integer'},
+        {'type': 'array', 'items': {'type': 'integer'}},
+    ]},
+    log={'type': 'boolean', 'description': "Colour density plots by log10 of the counts"},
+    z={'type': 'string', 'description': "Colour density plots by an aggregate of this column"},
+    aggregate={'type': 'string', 'description': "sum, mean (the default), min or max of z"},
+    visible={**STRING_ARRAY_SCHEMA, 'description': "Columns to show at first. The rest start hidden in the legend"},
+)
+# data parameters that each of the [[plot_torque_pro.plots]] sections can have its own of
+SELECTION_KEYS = ('columns', 'include', 'exclude', 'include_pattern', 'exclude_pattern', 'require')
 TOML_SCHEMA = {
     'type': 'object',
     'properties': dict(
@@ -48,6 +64,8 @@ TOML_SCHEMA = {
             'type': 'object',
             'properties': dict(
                 output_path={'type': 'string'},
+                lazy_traces={'type': 'boolean', 'description': "Write the data of traces that start hidden to their "
+                                                               "own files, which are only loaded when they're shown"},
                 data={
                     'description': "Parameters relating to how data should be read from csv",
                     'type': 'object',
@@ -57,6 +75,7 @@ TOML_SCHEMA = {
                             {'type': 'array', 'items': {'type': 'string'}},
                         ]},
                         session={'type': 'number'},
+                        preview={'type': 'integer', 'description': "Only read a sample of about this many rows"},
 
                         columns=STRING_ARRAY_SCHEMA,
                         include=STRING_ARRAY_SCHEMA,
@@ -65,6 +84,12 @@ TOML_SCHEMA = {
                         exclude_pattern=STRING_ARRAY_SCHEMA,
 
                         default_type={'type': 'string'},
+                        timestamps={**STRING_ARRAY_SCHEMA,
+                                    'description': "Columns to parse as timestamps. Defaults to Torque's time columns"},
+                        date_format={'anyOf': [
+                            {'type': 'string'},
+                            {'type': 'object', 'description': "Formats by column"},
+                        ]},
                         read_csv={'type': 'object', 'description': "Parameters passed as-is to pandas.read_csv()"},
 
                         dropna={'type': 'boolean'},
@@ -74,6 +99,10 @@ TOML_SCHEMA = {
                             {'type': 'string'}
                         ]},
 
+                        cache_dir={'type': 'string', 'description': "Where to keep filter outputs between runs"},
+                        cache_size_mb={'type': 'number'},
+                        workers={'type': 'integer', 'description': "Threads for filters. Defaults to cpu count"},
+
                         filters={
                             'type': 'array',
                             'items': {
@@ -82,20 +111,59 @@ TOML_SCHEMA = {
                                     source={'type': 'string'},
                                     destination={'type': 'string'},
                                     type={'type': 'string'},
+                                    nan={'type': 'string', 'description': "'propagate' (the default) or 'segment' to "
+                                                                          "filter each run between NaNs on its own"},
+                                    max_gap={'type': 'integer', 'description': "With nan = 'segment', filter across "
+                                                                               "gaps of up to this many NaNs"},
                                 ),
                                 'requiredProperties': ['source', 'type']
                             }
                         },
                     )
                 },
-                plot={
-                    'description': "Generally how data should be displayed",
+                summary={
+                    'description': "Statistics for each session, instead of a plot",
                     'type': 'object',
                     'properties': dict(
-                        x={'type': 'string'},
-                        y=STRING_ARRAY_SCHEMA,
-                        y2=STRING_ARRAY_SCHEMA,
+                        output_path={'type': 'string'},
+                        figure_path={'type': 'string'},
+                        statistics=STRING_ARRAY_SCHEMA,
+                        figure_statistic={'type': 'string'},
                     )
+                },
+                export={
+                    'description': "Write the filtered data to a file, instead of a plot",
+                    'type': 'object',
+                    'properties': dict(
+                        output_path={'type': 'string', 'description': "parquet, feather, arrow, npz or csv. A "
+                                                                      "{session} in it writes a file per session"},
+                    )
+                },
+                overlay={
+                    'description': "One trace per session, each aligned to the start of its session",
+                    'type': 'object',
+                    'properties': dict(
+                        y={'type': 'string'},
+                        align={'type': 'string', 'description': "'time', or a column such as a trip distance"},
+                        points={'type': 'integer', 'description': "Maximum points per session"},
+                    )
+                },
+                plot={
+                    'description': "Generally how data should be displayed",
+                    'type': 'object',
+                    'properties': PLOT_SCHEMA,
+                },
+                plots={
+                    'description': "One figure per section from the same data. Each section overrides the plot section",
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': dict(
+                            output_path={'type': 'string'},
+                            **{key: STRING_ARRAY_SCHEMA for key in SELECTION_KEYS},
+                            **PLOT_SCHEMA,
+                        ),
+                    },
                 }
             ),
         }
@@ -106,11 +174,12 @@ TOML_SCHEMA = {
 
 def process_config(config_file=None, **config_args):
     """ loads config file and adds/updates parameters with command-line parameters """
+    # the config gets modified in-place later on, so never hand out DEFAULT_CONFIG itself
     if config_file is None and not config_args:
         # base case
-        return DEFAULT_CONFIG
+        return copy.deepcopy(DEFAULT_CONFIG)
 
-    config = dict(DEFAULT_CONFIG)
+    config = copy.deepcopy(DEFAULT_CONFIG)
 
     if config_file is not None:
         config_from_toml = toml.load(config_file)
@@ -179,12 +248,47 @@ def normalize_config(config):
         config['data']['csv_path'] = [Path(path).expanduser() for path in config['data']['csv_path']]
     if config.get('output_path'):
         config['output_path'] = Path(config['output_path']).expanduser()
+    if config.get('export', {}).get('output_path'):
+        config['export']['output_path'] = Path(config['export']['output_path']).expanduser()
+    for key in ('output_path', 'figure_path'):
+        if config.get('summary', {}).get(key):
+            config['summary'][key] = Path(config['summary'][key]).expanduser()
+    for section in config.get('plots') or []:
+        if section.get('output_path'):
+            section['output_path'] = Path(section['output_path']).expanduser()
+    if config['data'].get('cache_dir'):
+        config['data']['cache_dir'] = Path(config['data']['cache_dir']).expanduser()
 
     # Let's also do any needed data augmentation here
     if config['plot'].get('x'):
         config['data']['require'].insert(0, config['plot']['x'])
 
 
+def figure_configs(config):
+    """
+    Returns a config for each [[plot_torque_pro.plots]] section, or [config] if there aren't any sections
+
+    Each section's output_path, column selection and plot parameters replace the config's own, and anything a section
+    doesn't set comes from the config's plot section.
+    """
+    if not config.get('plots'):
+        return [config]
+
+    configs = []
+    for section in config['plots']:
+        figure_config = copy.deepcopy({key: value for key, value in config.items() if key != 'plots'})
+        for key, value in copy.deepcopy(section).items():
+            if key == 'output_path':
+                figure_config[key] = value
+            elif key in SELECTION_KEYS:
+                figure_config['data'][key] = value
+            else:
+                figure_config['plot'][key] = value
+        configs.append(figure_config)
+
+    return configs
+
+
 def serialize_config(config):
     _add_metadata(config)
     toml_config = dict(plot_torque_pro=config)
@@ -246,12 +350,12 @@ def determine_columns(columns, data_config):
 
     # finally add back any required columns that weren't included so far
     if data_config.get('require') and included_columns is not None:
-        included_columns.extend(filter(lambda c: c not in included_columns, data_config['require']))
-
-        missing_columns = set(filter(lambda c: c not in set(included_columns), data_config['require']))
+        missing_columns = set(filter(lambda c: c not in set(columns), data_config['require']))
         if missing_columns:
             logger.error("The following required columns are not available: %s", missing_columns)
             raise ValueError("Some columns were listed as required but they are not available in the csv")
+
+        included_columns.extend(filter(lambda c: c not in included_columns, data_config['require']))
     data_config.pop('require', None)
 
 
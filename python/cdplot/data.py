@@ -1,25 +1,95 @@
 """
 Reads and plots data from csv
 """
+import bz2
+import contextlib
+import gzip
+import io
+import itertools
 import logging
+import lzma
+import os
 import re
+import shutil
 import tempfile
-from collections import defaultdict
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas
 from pandas._libs.lib import no_default
 
+from cdplot.timestamps import parse_timestamps
+from cdplot.workers import available_cpus
+
 logger = logging.getLogger(__name__)
 
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zip': 'zip',
+}
+COMPRESSION_MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'PK\x03\x04': 'zip',
+}
+COMPRESSION_OPENERS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+# how many characters of a session are handed to pandas at a time
+SESSION_READ_SIZE = 2**18
+
+# previews read this many evenly spaced runs of lines from each csv file
+PREVIEW_CHUNKS = 20
+HEADER_SEARCH_BYTES = 2**20
+
 
 def load_from_csv(config):
     csv_path = config['csv_path']
-    read_csv = config['read_csv']
 
     if not csv_path:
         raise ValueError("Nothing to plot")
 
+    read_args = read_csv_args(config)
+
+    # sessions are read straight from the csv files, so nothing is written to disk, even for compressed files
+    with contextlib.closing(stream_sessions(*csv_path, preview=config.get('preview'))) as sessions:
+        if config.get('session') is not None:
+            index = int(config['session'])
+            if index >= 0:
+                session = next(itertools.islice(sessions, index, None), None)
+                last_sessions = [] if session is None else [pandas.read_csv(session, **read_args)]
+            else:
+                # counting from the end, so only the last few sessions are kept on the way to the end
+                last_sessions = deque((pandas.read_csv(session, **read_args) for session in sessions), maxlen=-index)
+                last_sessions = list(last_sessions)[:1] if len(last_sessions) == -index else []
+
+            if not last_sessions:
+                raise ValueError(f"There is no session {config['session']}")
+            all_dataframes = last_sessions
+        else:
+            all_dataframes = [pandas.read_csv(session, **read_args) for session in sessions]
+
+    csv_dataframe = all_dataframes[0] if len(all_dataframes) == 1 else pandas.concat(all_dataframes)
+    return clean_data(csv_dataframe, config)
+
+
+def read_session(session_path, config):
+    """ Reads one session csv file written by preprocess_data(), the same way load_from_csv() would """
+    return clean_data(pandas.read_csv(session_path, **read_csv_args(config)), config)
+
+
+def read_csv_args(config):
+    """ Returns the keyword arguments for pandas.read_csv() """
+    read_csv = config['read_csv']
+
     # Because read_csv allows you to pass a defaultdict(), and that can't be represented in toml,
     # we add default_type and do this custom logic
     if config.get('default_type'):
@@ -28,17 +98,12 @@ def load_from_csv(config):
     else:
         dtypes = read_csv.get('dtype')
 
-    read_args = dict(read_csv, dtype=dtypes)
+    return dict(read_csv, dtype=dtypes)
 
-    # Split the data into multiple CSVs if necessary
-    with preprocess_data(*csv_path) as sessions:
-        if config.get('session') is not None:
-            csv_dataframe = pandas.read_csv(sessions[config['session']], **read_args)
-        elif len(sessions) == 1:
-            csv_dataframe = pandas.read_csv(sessions[0], **read_args)
-        else:
-            all_dataframes = [pandas.read_csv(f, **read_args) for f in sessions]
-            csv_dataframe = pandas.concat(all_dataframes)
+
+def clean_data(csv_dataframe, config):
+    """ Parses timestamps, and drops or fills missing values, as configured """
+    parse_timestamps(csv_dataframe, config)
 
     if config.get('dropna', False):
         csv_dataframe.dropna(inplace=True, thresh=config.get('dropna_threshold', no_default))
@@ -48,72 +113,346 @@ def load_from_csv(config):
     return csv_dataframe
 
 
-def preprocess_data(*csv_paths):
+def stream_sessions(*csv_paths, preview=None):
+    """
+    Yields a file-like object for each session in csv_paths, which pandas.read_csv() can read straight from the csv file
+
+    Compressed csv files are decompressed on the fly, so unlike preprocess_data() nothing is written to disk. All of
+    the sessions come from one pass through each file, so each session has to be read before the next one is asked for.
+    """
+    for csv_path in expand_archives(*csv_paths):
+        if preview:
+            yield from iter_sessions(sample_lines(csv_path, preview))
+        else:
+            with open_csv(csv_path) as fh:
+                yield from iter_sessions(fh)
+
+
+def preprocess_data(*csv_paths, preview=None):
     """
     Splits each csv files into one or more "session" csv files and returns a flat list of all session files
 
     CSV files are allows to have multiple header rows. Each time we see a header, we might have different columns.
     Split each into "session" csv files every time we see a new header row.
+
+    Compressed csv files (gzip, bz2, xz) are streamed as-is, and each csv in a zip archive is treated as though it had
+    been passed as its own csv path. Sessions from compressed files are written gzip-compressed (as session_N.csv.gz),
+    so that splitting them doesn't take up more disk space than the compressed file does.
+
+    If preview is a number of rows, only a sample of about that many rows is read from each csv file (see
+    sample_lines()), so the time it takes doesn't depend on the size of the files.
     """
     session_paths = []
+    session_sources = []
     temp_dir = Path(tempfile.mkdtemp(prefix='plot_torque_pro_'))
 
-    for csv_path in csv_paths:
-        session_paths.extend(preprocess_csv(csv_path, temp_dir, len(session_paths)))
+    for csv_path in expand_archives(*csv_paths):
+        new_paths = preprocess_csv(csv_path, temp_dir, len(session_paths), preview)
+        session_paths.extend(new_paths)
+        session_sources.extend([csv_path] * len(new_paths))
+
+    return TemporaryCSV(session_paths, temp_dir, session_sources)
 
-    return TemporaryCSV(session_paths, temp_dir)
 
+def map_sessions(function, csv_paths, *args, workers=None):
+    """
+    Calls function(session_path, *args) for every session in csv_paths, on up to workers processes
 
-def preprocess_csv(csv_path, temp_dir, starting_session=0):
+    function has to be picklable, and so do args. Each call only gets one session, so a worker holds at most one
+    session in memory at a time. Returns a list of (source csv path, result) in session order.
+    """
+    temporary_csv = preprocess_data(*csv_paths)
+    with temporary_csv as sessions:
+        logger.info("Processing %d sessions", len(sessions))
+        arguments = [sessions] + [[arg] * len(sessions) for arg in args]
+
+        workers = min(workers or available_cpus(), max(len(sessions), 1))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(function, *arguments))
+        else:
+            results = list(map(function, *arguments))
+
+    return list(zip(temporary_csv.sources, results))
+
+
+def preprocess_csv(csv_path, temp_dir, starting_session=0, preview=None):
     """ Looks for likely header rows, and calls split_csv to output multiple "session" csv files """
-    header_indices = []
-    with csv_path.open() as fh:
-        for index, line in enumerate(fh):
-            has_numeric = re.search(r'(,\s?-?\d+([\.,]\d*)?([eE]\d+[\.,]?\d*)?,)+', line)
-            if has_numeric is None:
-                logger.debug("session %d = %s", len(header_indices), line.strip())
-                header_indices.append(index)
+    compress = isinstance(csv_path, ZipMember) or detect_compression(csv_path) is not None
+    if preview:
+        return split_csv(sample_lines(csv_path, preview), temp_dir, starting_session, compress)
 
-    # split the file into multiple files, and cleanup data
-    split_indices = header_indices + [index + 1]
-    return split_csv(csv_path, split_indices, temp_dir, starting_session)
+    with open_csv(csv_path) as fh:
+        return split_csv(fh, temp_dir, starting_session, compress)
 
 
-def split_csv(csv_path, split_indices, temp_dir, starting_session=0):
-    """ Writes multiple csv files from one csv file, splitting at the given rows """
-    split_indices = split_indices[1:] if split_indices[0] == 0 else split_indices
+def sample_lines(csv_path, rows):
+    """
+    Yields about rows lines from csv_path, as PREVIEW_CHUNKS evenly spaced runs of lines
 
-    with csv_path.open() as fh:
-        output_iter = iter(CSVSplitter(split_indices, temp_dir, starting_session))
-        output_handle, next_index = next(output_iter)
+    Each run starts at the first whole line after an evenly spaced byte offset, so only the sampled lines are ever read.
+    When a run doesn't have as many fields as the last header row, it's from another session, and that session's
+    header is looked for in the HEADER_SEARCH_BYTES before the run. Runs whose header can't be found are skipped.
 
-        try:
-            split_paths = [Path(output_handle.name)]
+    Compressed files can't be read from the middle without decompressing everything before it, so for those it's just
+    the first rows lines.
+    """
+    if isinstance(csv_path, ZipMember) or detect_compression(csv_path) is not None:
+        with open_csv(csv_path) as fh:
+            yield from itertools.islice(fh, rows)
+        return
+
+    chunk_rows = max(rows // PREVIEW_CHUNKS, 1)
+    size = os.path.getsize(csv_path)
+    fields = None
+
+    with open(csv_path, 'rb') as fh:
+        for chunk in range(PREVIEW_CHUNKS):
+            offset = size * chunk // PREVIEW_CHUNKS
+            # in a small file the runs meet, and it's simply read from start to end
+            if offset > fh.tell():
+                fh.seek(offset)
+                fh.readline()
+
+            start = fh.tell()
+            lines = [line.decode('utf-8', errors='replace') for line in itertools.islice(fh, chunk_rows)]
+            end = fh.tell()
+
+            if lines and fields is not None and not is_header(lines[0]) and lines[0].count(',') != fields:
+                header = _find_header(fh, start)
+                fh.seek(end)
+                if header is None:
+                    continue
+                lines.insert(0, header)
+
+            for line in lines:
+                if is_header(line):
+                    fields = line.count(',')
+                elif fields is not None and line.count(',') != fields:
+                    continue
+                yield line
+
+
+def _find_header(fh, offset):
+    """ Returns the last header row before offset in fh, or None if there isn't one in HEADER_SEARCH_BYTES before it """
+    start = max(offset - HEADER_SEARCH_BYTES, 0)
+    fh.seek(start)
+    lines = fh.read(offset - start).decode('utf-8', errors='replace').splitlines(keepends=True)
+
+    # the first line is only part of a line, unless it's the start of the file
+    for line in reversed(lines[1:] if start else lines):
+        if is_header(line):
+            return line
+    return None
+
+
+def split_csv(csv_lines, temp_dir, starting_session=0, compress=False):
+    """
+    Writes multiple csv files from one csv file, starting a new file at every header row
+
+    This only reads through csv_lines once, so it works just as well on a decompressing stream as on a plain file.
+    """
+    output_iter = iter(CSVSplitter(temp_dir, starting_session, compress))
+    split_paths = []
 
-            for index, line in enumerate(fh):
-                if index >= next_index:
-                    # rotate the file
-                    output_handle, next_index = next(output_iter)
-                    split_paths.append(Path(output_handle.name))
+    try:
+        for session in iter_sessions(csv_lines, starting_session):
+            # rotate the file
+            output_handle = next(output_iter)
+            split_paths.append(Path(output_handle.name))
+            shutil.copyfileobj(session, output_handle, SESSION_READ_SIZE)
 
-                output_handle.write(fix_torque_data(line))
+    except (IOError, EOFError):
+        output_iter.close()
+        _cleanup_tmp(split_paths, temp_dir)
+        raise
 
-        except IOError:
-            output_handle.close()
-            _cleanup_tmp(split_paths + [Path(output_handle.name)], temp_dir)
-            raise
+    finally:
+        output_iter.close()
 
     return split_paths
 
 
+def iter_sessions(csv_lines, starting_session=0):
+    """
+    Yields a SessionReader for each session in csv_lines, starting a new session at every header row
+
+    The sessions share one pass through csv_lines, so whatever's left of a session when the next one is asked for is
+    skipped.
+    """
+    lines = iter(csv_lines)
+    line = next(lines, None)
+    session_index = starting_session
+
+    while line is not None:
+        if is_header(line):
+            logger.debug("session %d = %s", session_index, line.strip())
+
+        session = SessionReader(line, lines)
+        yield session
+        session.skip()
+
+        line = session.next_header
+        session_index += 1
+
+
+class SessionReader(io.TextIOBase):
+    """ Reads the lines of one session from a shared iterator of lines, up to the next header row """
+    def __init__(self, first_line, lines):
+        super().__init__()
+        self._lines = lines
+        self._buffer = fix_torque_data(first_line)
+        self._finished = False
+        # the header row that ended this session, or None at the end of the file
+        self.next_header = None
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        unlimited = size is None or size < 0
+        self._fill(None if unlimited else size)
+
+        if unlimited or len(self._buffer) <= size:
+            text, self._buffer = self._buffer, ''
+        else:
+            text, self._buffer = self._buffer[:size], self._buffer[size:]
+        return text
+
+    def readline(self, size=-1):
+        while '\n' not in self._buffer and not self._finished:
+            self._fill(len(self._buffer) + SESSION_READ_SIZE)
+
+        line, newline, self._buffer = self._buffer.partition('\n')
+        return line + newline
+
+    def _fill(self, size=None):
+        """ Adds lines to the buffer until it has at least size characters, or the session ends """
+        chunks = [self._buffer]
+        length = len(self._buffer)
+
+        while not self._finished and (size is None or length < size):
+            line = next(self._lines, None)
+            if line is None or is_header(line):
+                self.next_header = line
+                self._finished = True
+                break
+
+            line = fix_torque_data(line)
+            chunks.append(line)
+            length += len(line)
+
+        self._buffer = ''.join(chunks)
+
+    def skip(self):
+        """ Reads to the end of the session without keeping any of it """
+        while not self._finished:
+            self._buffer = ''
+            self._fill(SESSION_READ_SIZE)
+        self._buffer = ''
+
+
+def is_header(csv_line):
+    """ Header rows are the ones that don't have any numeric fields in them """
+    has_numeric = re.search(r'(,\s?-?\d+([\.,]\d*)?([eE]\d+[\.,]?\d*)?,)+', csv_line)
+    return has_numeric is None
+
+
+def detect_compression(csv_path):
+    """ Returns 'gzip', 'bz2', 'xz', 'zip' or None, going by file extension first and then by magic bytes """
+    csv_path = Path(csv_path)
+    if csv_path.suffix.lower() in COMPRESSION_EXTENSIONS:
+        return COMPRESSION_EXTENSIONS[csv_path.suffix.lower()]
+
+    with csv_path.open('rb') as fh:
+        magic = fh.read(max(map(len, COMPRESSION_MAGIC)))
+
+    for magic_bytes, compression in COMPRESSION_MAGIC.items():
+        if magic.startswith(magic_bytes):
+            return compression
+
+    return None
+
+
+def expand_archives(*csv_paths):
+    """ Replaces each zip archive in csv_paths with one ZipMember per csv file in that archive """
+    for csv_path in csv_paths:
+        if isinstance(csv_path, ZipMember) or detect_compression(csv_path) != 'zip':
+            yield csv_path
+            continue
+
+        with zipfile.ZipFile(csv_path) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+
+        if not members:
+            logger.warning("%s doesn't contain any files", str(csv_path))
+        for member in sorted(members):
+            yield ZipMember(Path(csv_path), member)
+
+
+def open_csv(csv_path, encoding=None):
+    """ Opens csv_path for reading as text, decompressing on the fly if necessary """
+    if isinstance(csv_path, ZipMember):
+        return csv_path.open(encoding=encoding)
+
+    compression = detect_compression(csv_path)
+    if compression == 'zip':
+        # a zip with one csv in it can still be opened like a file
+        members = list(expand_archives(csv_path))
+        if len(members) != 1:
+            raise ValueError(f"{csv_path} contains {len(members)} files. Use preprocess_data() to read all of them")
+        return members[0].open(encoding=encoding)
+
+    if compression is not None:
+        return COMPRESSION_OPENERS[compression](csv_path, 'rt', encoding=encoding)
+
+    return Path(csv_path).open(encoding=encoding)
+
+
+class ZipMember:
+    """ One file inside a zip archive. Behaves enough like a Path for the rest of this module """
+    def __init__(self, archive_path, name):
+        self.archive_path = archive_path
+        self.name = name
+
+    def open(self, encoding=None):
+        archive = zipfile.ZipFile(self.archive_path)
+        try:
+            member = archive.open(self.name)
+        except Exception:
+            archive.close()
+            raise
+
+        # the member handle keeps its own reference to the archive's file, so we can close the ZipFile right away
+        archive.close()
+        inner_compression = COMPRESSION_EXTENSIONS.get(Path(self.name).suffix.lower())
+        if inner_compression in COMPRESSION_OPENERS:
+            return COMPRESSION_OPENERS[inner_compression](member, 'rt', encoding=encoding)
+        return io.TextIOWrapper(member, encoding=encoding)
+
+    def __str__(self):
+        return f'{self.archive_path}/{self.name}'
+
+    def __repr__(self):
+        return f'ZipMember({str(self.archive_path)!r}, {self.name!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, ZipMember) and (self.archive_path, self.name) == (other.archive_path, other.name)
+
+    def __hash__(self):
+        return hash((self.archive_path, self.name))
+
+
 def fix_torque_data(csv_line):
     return re.sub('∞', 'inf', csv_line)
 
 
 class TemporaryCSV:
-    def __init__(self, csv_paths, temp_dir=None):
+    def __init__(self, csv_paths, temp_dir=None, sources=None):
         self.csv_paths = csv_paths
         self.temp_dir = temp_dir
+        # the csv file (or ZipMember) each session came from
+        self.sources = sources
 
     def __enter__(self):
         return self.csv_paths
@@ -124,19 +463,36 @@ class TemporaryCSV:
 
 
 class CSVSplitter:
-    def __init__(self, indices, dest_dir, start_index=0):
-        self.indices = indices
+    """ Generates a new session file each time the next file is requested """
+    def __init__(self, dest_dir, start_index=0, compress=False):
         self.dest_path = Path(dest_dir)
         self.start_index = start_index
+        self.compress = compress
 
     def __iter__(self):
-        output_path = self.dest_path / f'session_{self.start_index}.csv'
-        for session_index, next_index in enumerate(self.indices):
-            output_handle = output_path.open('wt')
-            yield output_handle, next_index
-
-            output_handle.close()
-            output_path = self.dest_path / f'session_{self.start_index + session_index + 1}.csv'
+        session_index = self.start_index
+        output_handle = None
+        try:
+            while True:
+                if self.compress:
+                    # the fastest level, since these are only read back once
+                    output_path = self.dest_path / f'session_{session_index}.csv.gz'
+                    output_handle = gzip.open(output_path, 'wt', compresslevel=1)
+                else:
+                    output_path = self.dest_path / f'session_{session_index}.csv'
+                    output_handle = output_path.open('wt')
+                yield output_handle
+
+                output_handle.close()
+                session_index += 1
+        finally:
+            if output_handle is not None:
+                output_handle.close()
+
+
+def session_index(session_path):
+    """ Returns the number of a session file written by preprocess_data() """
+    return int(Path(session_path).name.split('.')[0].rsplit('_', 1)[-1])
 
 
 def _cleanup_tmp(split_paths, temp_dir):
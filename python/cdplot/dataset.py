@@ -0,0 +1,177 @@
+"""
+In-process API for loading csv data once, and then filtering and plotting it as many times as needed
+"""
+import copy
+import logging
+from multiprocessing.pool import ThreadPool
+
+from cdplot.cache import OperationCache
+from cdplot.columns import ColumnStore
+from cdplot.config import determine_columns, figure_configs, process_config
+from cdplot.data import load_from_csv, read_session
+from cdplot.filters import create_data_operators, operation_keys, process_data
+from cdplot.plot import mark_preview, render_plot
+from cdplot.workers import available_cpus
+
+logger = logging.getLogger(__name__)
+
+
+def augment_data(csv_data, config, results=None):
+    """
+    Augments or updates csv data with any operations specified in the config
+
+    csv_data can be a DataFrame or a ColumnStore. Either way a ColumnStore is returned, which shares its arrays with
+    csv_data rather than copying them. A DataFrame passed in is left as it was.
+    """
+    if not isinstance(csv_data, ColumnStore):
+        csv_data = ColumnStore.from_dataframe(csv_data)
+    csv_data.x = config['plot'].get('x')
+
+    # Augment data as needed
+    operations = list(create_data_operators(config, csv_data.columns))
+    process_data(csv_data, operations, results, cache=OperationCache.from_config(config['data']),
+                 workers=config['data'].get('workers'))
+
+    # Then truncate data as needed
+    plot_columns = determine_columns(csv_data.columns, config['data'])
+    return csv_data.select(plot_columns)
+
+
+def augment_session(session_path, config):
+    """
+    Reads and augments one session file written by preprocess_data(), as a worker of map_sessions() does. Returns None
+    if the session is empty, or doesn't have the columns that config needs
+    """
+    config = copy.deepcopy(config)
+    # sessions are already spread across processes
+    config['data']['workers'] = 1
+
+    csv_dataframe = read_session(session_path, config['data'])
+    if csv_dataframe.empty:
+        return None
+
+    try:
+        return augment_data(csv_dataframe, config)
+    except ValueError:
+        # sessions don't all have the same columns
+        logger.warning("Skipping %s because it doesn't have the columns that are needed", str(session_path))
+        return None
+
+
+class Dataset:
+    """
+    Csv data that's read once and kept in memory
+
+    The config is the same dictionary that process_config() returns. Each call to augment(), render() or export() works
+    on its own copy of the config, so the same Dataset can be plotted with different settings. Filter outputs are
+    remembered by their operation config, so a filter is only computed once no matter how many figures use it.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._data = None
+        self._results = {}
+
+    @classmethod
+    def from_config(cls, config_file=None, **config_args):
+        """ Same arguments as process_config(). config_args are the same as the command-line arguments """
+        return cls(process_config(config_file, **config_args))
+
+    @classmethod
+    def from_csv(cls, *csv_paths, **config_args):
+        return cls.from_config(csv_path=list(csv_paths), **config_args)
+
+    @property
+    def data(self):
+        """ The csv data as it was read, before any filters are applied """
+        if self._data is None:
+            self._data = load_from_csv(self.config['data'])
+        return self._data
+
+    def augment(self, config=None):
+        """ Returns the filtered and truncated data as a ColumnStore. config defaults to this dataset's config """
+        config = copy.deepcopy(self.config if config is None else config)
+        return self._augment(config)
+
+    def render(self, plot_config=None, **plot_args):
+        """
+        Returns a plotly figure. plot_config replaces the [plot_torque_pro.plot] section of the config, and plot_args
+        update individual plot parameters
+        """
+        config = copy.deepcopy(self.config)
+        if plot_config is not None:
+            config['plot'] = copy.deepcopy(plot_config)
+        config['plot'].update(plot_args)
+
+        return self._render(config)
+
+    def render_figures(self, workers=None):
+        """
+        Returns a list of (config, figure), with a figure for each [[plot_torque_pro.plots]] section of the config, or
+        just the one figure if there aren't any sections
+
+        The filters are computed once, with the config's own x-axis, and then the figures are rendered from the same
+        filtered data on up to workers threads.
+        """
+        configs = figure_configs(self.config)
+        if len(configs) == 1:
+            return [(configs[0], self._render(copy.deepcopy(configs[0])))]
+
+        # every section uses the config's own filters, whatever its x-axis is, so compute them before the sections are
+        # rendered side by side
+        config = copy.deepcopy(self.config)
+        create_data_operators(config, list(self.data.columns))
+        # building the filters excludes their intermediate columns, and the sections have to exclude them too
+        intermediates = [name for name in config['data'].get('exclude', [])
+                         if name not in self.config['data'].get('exclude', [])]
+        self._augment(config)
+
+        for figure_config in configs:
+            figure_config['data']['_operations'] = config['data'].get('_operations')
+            figure_config['data']['exclude'] = list(figure_config['data'].get('exclude') or []) + intermediates
+
+        workers = min(workers or available_cpus(), len(configs))
+        with ThreadPool(workers) as pool:
+            figures = pool.map(self._render, copy.deepcopy(configs))
+        return list(zip(configs, figures))
+
+    def prune_results(self):
+        """
+        Forgets the remembered filter outputs that this dataset's config no longer uses, such as those of filters that
+        have since been edited
+        """
+        config = copy.deepcopy(self.config)
+        used = set(operation_keys(create_data_operators(config, list(self.data.columns))))
+        for key in [key for key in self._results if key not in used]:
+            del self._results[key]
+
+    def export(self, output_path=None):
+        """
+        Returns the filtered data as a DataFrame, and writes it to output_path if given, as parquet, feather, arrow, npz
+        or csv depending on its extension
+        """
+        # export imports this module
+        from cdplot.export import write_table
+
+        csv_data = self.augment()
+        if output_path is not None:
+            write_table(csv_data, output_path)
+            logger.info("Written to %s", str(output_path))
+
+        return csv_data.to_dataframe()
+
+    def _render(self, config):
+        # the x-axis may have changed, so make sure it's not truncated away
+        x_axis = config['plot'].get('x')
+        if x_axis and x_axis not in config['data'].setdefault('require', []):
+            config['data']['require'].insert(0, x_axis)
+
+        csv_data = self._augment(config)
+        fig = render_plot(csv_data, config['plot'])
+        if config['data'].get('preview'):
+            mark_preview(fig, config['data']['preview'])
+        return fig
+
+    def _augment(self, config):
+        # filter outputs are added to a new ColumnStore, and never to the data we loaded
+        return augment_data(self.data, config, self._results)
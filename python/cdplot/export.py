@@ -0,0 +1,89 @@
+"""
+Writes filtered data to files instead of plotting it
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from cdplot.columns import ColumnStore
+from cdplot.data import load_from_csv, map_sessions, session_index
+from cdplot.dataset import augment_data, augment_session
+
+logger = logging.getLogger(__name__)
+
+# parquet, feather and arrow need pyarrow. Feather version 2 is the Arrow IPC file format, so .arrow files are written
+# as feather files
+TABLE_FORMATS = {
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'arrow',
+    '.npz': 'npz',
+    '.csv': 'csv',
+}
+
+
+def export(config):
+    """
+    Writes the filtered data to plot_torque_pro.export.output_path, without making a figure. Returns the paths written
+
+    If output_path has "{session}" in it, each session is read, filtered and written to its own file by a worker
+    process, with {session} replaced by the session's number.
+    """
+    output_path = str(config['export']['output_path'])
+    if not config['data']['csv_path']:
+        raise ValueError("Nothing to export")
+
+    if '{session}' not in output_path:
+        csv_data = augment_data(load_from_csv(config['data']), config)
+        write_table(csv_data, output_path)
+        logger.info("Written to %s", output_path)
+        return [Path(output_path)]
+
+    results = map_sessions(export_session, config['data']['csv_path'], config, workers=config['data'].get('workers'))
+    output_paths = [session_path for _, session_path in results if session_path is not None]
+    logger.info("Written %d sessions to %s", len(output_paths), output_path)
+    return output_paths
+
+
+def export_session(session_path, config):
+    """ Reads, filters and writes one session. Returns the path it was written to, or None if it was skipped """
+    csv_data = augment_session(session_path, config)
+    if csv_data is None:
+        return None
+
+    output_path = Path(str(config['export']['output_path']).format(session=session_index(session_path)))
+    write_table(csv_data, output_path)
+    return output_path
+
+
+def write_table(table, output_path):
+    """ Writes a DataFrame or ColumnStore as parquet, feather, arrow, npz or csv, going by output_path's extension """
+    output_format = table_format(output_path)
+
+    if output_format == 'npz':
+        columns = table if isinstance(table, ColumnStore) else {name: table[name].to_numpy() for name in table.columns}
+        # strings are saved as fixed-width unicode rather than as pickled objects, so they load without allow_pickle
+        arrays = {name: columns[name].astype(str) if columns[name].dtype.kind == 'O' else columns[name]
+                  for name in columns}
+        with open(output_path, 'wb') as fh:
+            np.savez(fh, **arrays)
+        return
+
+    if isinstance(table, ColumnStore):
+        table = table.to_dataframe()
+
+    if output_format == 'parquet':
+        table.to_parquet(output_path, index=False)
+    elif output_format == 'feather':
+        table.to_feather(output_path)
+    elif output_format == 'arrow':
+        # uncompressed, so that any Arrow IPC reader can memory-map it
+        table.to_feather(output_path, compression='uncompressed')
+    else:
+        table.to_csv(output_path, index=False)
+
+
+def table_format(output_path):
+    """ Returns the format output_path's extension names. Anything that isn't known is csv """
+    return TABLE_FORMATS.get(Path(output_path).suffix.lower(), 'csv')
@@ -1,16 +1,20 @@
 """
 Creates a bunch of operations to perform on columns of csv data
 """
+import json
 import logging
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import numpy as np
 
 from cdplot.exceptions import PlotTorqueProException
+from cdplot.workers import available_cpus
 
 try:
     import scipy
+    import scipy.signal
     SCIPY_AVAILABLE = True
 except ImportError:
     SCIPY_AVAILABLE = False
@@ -18,6 +22,13 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Windows up to this long are always convolved directly, which is exact and faster than an FFT at this size
+DIRECT_CONVOLUTION_MAX = 128
+# Below this many multiply-adds direct convolution is cheap no matter how the work is split between the two lengths
+DIRECT_CONVOLUTION_MAX_WORK = 2**20
+# Overlap-add beats one big FFT once the signal is this many times longer than the window
+OVERLAP_ADD_MIN_RATIO = 8
+
 
 def create_data_operators(config, columns):
     """ Create data operators needs to know what columns are available, so it is called after loading data """
@@ -35,14 +46,111 @@ def create_data_operators(config, columns):
     return factory.build_operations()
 
 
-def process_data(dataframe, operations):
-    for operation in operations:
-        logger.debug("Performing %s", operation)
-        operation(dataframe)
+def process_data(dataframe, operations, results=None, cache=None, workers=None):
+    """
+    Performs each operation on dataframe
+
+    Operations are grouped into stages by schedule_operations(), and the operations in each stage are computed on a
+    pool of up to workers threads (the number of cpus by default). Outputs are always written back in the original order
+    of the operations, so the result is the same as performing them one at a time.
+
+    If results is a dictionary, it's used to remember the output of each operation, and any operation whose output is
+    already in results is skipped and the remembered output is used instead. cache is an optional OperationCache that
+    does the same thing on disk, so that outputs are remembered between runs.
+    """
+    stages = schedule_operations(operations)
+    workers = workers or available_cpus()
+    max_stage = max(map(len, stages), default=0)
+
+    if workers > 1 and max_stage > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, max_stage), thread_name_prefix='cdplot-filter') as pool:
+            _process_stages(dataframe, stages, results, cache, pool.map)
+    else:
+        _process_stages(dataframe, stages, results, cache, map)
 
     return dataframe
 
 
+def _process_stages(dataframe, stages, results, cache, map_function):
+    producers = {}
+    cache_producers = {}
+
+    for stage in stages:
+        outputs = {}
+        keys = {}
+        pending = []
+
+        for operation in stage:
+            key = keys[operation] = operation.key(producers)
+            cache_key = cache.key(operation, dataframe, cache_producers) if cache is not None else None
+            cache_producers[operation.dest] = cache_key
+
+            if results is not None and key in results:
+                logger.debug("Reusing %s", operation)
+                outputs[operation] = results[key]
+                continue
+
+            cached = cache.get(cache_key) if cache is not None else None
+            if cached is not None:
+                logger.debug("Loading %s from cache", operation)
+                outputs[operation] = cached
+            else:
+                logger.debug("Performing %s", operation)
+                pending.append(operation)
+
+        # nothing in a stage reads anything that's written in the same stage, so these can run concurrently
+        for operation, output in zip(pending, map_function(lambda op: op.compute(dataframe), pending)):
+            outputs[operation] = output
+
+        for operation in stage:
+            dataframe[operation.dest] = outputs[operation]
+            if cache is not None and operation in pending:
+                cache.put(cache_producers[operation.dest], dataframe[operation.dest])
+            if results is not None:
+                results[keys[operation]] = dataframe[operation.dest]
+            producers[operation.dest] = keys[operation]
+
+
+def operation_keys(operations):
+    """ Returns the key of each operation, which is what process_data() remembers its output by in results """
+    producers = {}
+    keys = []
+    for operation in operations:
+        keys.append(operation.key(producers))
+        producers[operation.dest] = keys[-1]
+    return keys
+
+
+def schedule_operations(operations):
+    """
+    Groups operations into stages that have to run one after another. Operations within a stage are independent
+
+    An operation goes in a later stage than anything that writes a column it reads or writes. It can share a stage with
+    operations that read the column it writes, because outputs are only written once the whole stage has been computed.
+    Each stage keeps the operations in their original order.
+    """
+    stages = []
+    last_write = {}
+    last_read = {}
+
+    for operation in operations:
+        stage = 0
+        for name in operation.inputs + [operation.dest]:
+            if name in last_write:
+                stage = max(stage, last_write[name] + 1)
+        stage = max(stage, last_read.get(operation.dest, 0))
+
+        if stage == len(stages):
+            stages.append([])
+        stages[stage].append(operation)
+
+        for name in operation.inputs:
+            last_read[name] = max(last_read.get(name, 0), stage)
+        last_write[operation.dest] = stage
+
+    return stages
+
+
 class OperatorFactory:
     """ Stateful class for instantiating """
 
@@ -73,25 +181,29 @@ class OperatorFactory:
         source = op_config['source']
         destination = op_config.get('destination', source)
         filter_type = op_config.get('type', 'lti')
+        # how filters treat NaNs in their input
+        nan_config = {key: op_config[key] for key in ('nan', 'max_gap') if key in op_config}
 
         if filter_type == 'integral':
             delta_x = self.make_delta_x(config, columns)
             product = self.add_intermediate(config, source, 'product', dict(column=delta_x))
-            self.add_lfilter(product, destination, coefficients=dict(numerator=[1], denominator=[1, -1]))
+            self.add_lfilter(product, destination, coefficients=dict(numerator=[1], denominator=[1, -1]), **nan_config)
 
         elif filter_type == 'differential':
             delta_x = self.make_delta_x(config, columns)
             product = self.add_intermediate(config, source, 'product', dict(column=delta_x))
-            self.add_lfilter(product, destination, coefficients=dict(numerator=[1], denominator=[1, 1]))
+            self.add_lfilter(product, destination, coefficients=dict(numerator=[1], denominator=[1, 1]), **nan_config)
 
         elif filter_type == 'accumulator':
-            self.add_lfilter(source, destination, coefficients=dict(numerator=[1], denominator=[1, -1]))
+            self.add_lfilter(source, destination, coefficients=dict(numerator=[1], denominator=[1, -1]), **nan_config)
 
         elif filter_type in ('lti', 'lfilter', 'linear_filter'):
-            self.add_lfilter(source, destination, op_config['coefficients'], op_config.get('initial_conditions'))
+            self.add_lfilter(source, destination, op_config['coefficients'], op_config.get('initial_conditions'),
+                             **nan_config)
 
         elif filter_type == 'average':
-            self.add_convolution(source, destination, op_config['coefficients'])
+            self.add_convolution(source, destination, op_config['coefficients'], op_config.get('offset'),
+                                 op_config.get('method', 'auto'), **nan_config)
 
         elif filter_type == 'product':
             parameters = dict(column=op_config.get('column'), constant=op_config.get('constant'))
@@ -134,13 +246,15 @@ class OperatorFactory:
         return dict(source=source, destination=destination, type=op_type, **op_params)
 
 
-    def add_lfilter(self, source, destination, coefficients, initial_conditions=None):
+    def add_lfilter(self, source, destination, coefficients, initial_conditions=None, **nan_config):
         """ Add a linear filter """
-        config = dict(coefficients=coefficients, initial_conditions=initial_conditions)
+        config = dict(coefficients=coefficients, initial_conditions=initial_conditions, **nan_config)
         self.add_operation(source, destination, 'lfilter', config)
 
-    def add_convolution(self, source, destination, window, offset=None):
-        self.add_operation(source, destination, 'convolution', dict(window=window, offset=offset))
+    def add_convolution(self, source, destination, window, offset=None, method='auto', **nan_config):
+        """ Add a convolution. window is either the coefficients or the length of a moving average """
+        self.add_operation(source, destination, 'convolution',
+                           dict(window=window, offset=offset, method=method, **nan_config))
 
     def add_product(self, source, destination, config):
         """ Add a multiplication operation """
@@ -177,10 +291,36 @@ class Operation:
         self.source = op_config['source']
         self.dest = op_config['destination']
         self.operation = op_config['type']
+        self.config = op_config
         self._func = self.build_operation(op_config)
 
     def __call__(self, csv_dataframe):
-        csv_dataframe[self.dest] = self._func(csv_dataframe)
+        csv_dataframe[self.dest] = self.compute(csv_dataframe)
+
+    def compute(self, csv_dataframe):
+        """ Returns this operation's output without adding it to csv_dataframe """
+        return self._func(csv_dataframe)
+
+    @property
+    def inputs(self):
+        """ Names of the columns this operation reads """
+        column = self.config.get('column')
+        return [self.source] if not column else [self.source, column]
+
+    def key(self, producers=None):
+        """
+        Returns a string that identifies what this operation computes, regardless of what its output is called
+
+        producers maps column names to the keys of the operations that produced them, so that two operations only have
+        the same key if they have the same parameters and their inputs were computed the same way.
+        """
+        producers = producers or {}
+        key_config = {name: value for name, value in self.config.items() if name != 'destination'}
+        for name in ('source', 'column'):
+            if key_config.get(name) in producers:
+                key_config[name] = dict(key=producers[key_config[name]])
+
+        return json.dumps(key_config, sort_keys=True, default=str)
 
     def __str__(self):
         return f'{self.operation}("{self.source}" => "{self.dest}"): {self._func}'
@@ -190,7 +330,12 @@ class Operation:
         return bound_operator(csv_dataframe[self.source])
 
     def _do_filter(self, csv_dataframe, lfilter):
-        return lfilter(csv_dataframe[self.source])
+        if self.config.get('nan', 'propagate') == 'propagate':
+            return lfilter(csv_dataframe[self.source])
+        if self.config['nan'] != 'segment':
+            raise PlotTorqueProException(f"Unknown nan policy: {self.config['nan']}")
+
+        return filter_segments(csv_dataframe[self.source], lfilter, self.config.get('max_gap', 0))
 
     def _do_sum(self, csv_dataframe, constant=None, column=None):
         if column:
@@ -199,13 +344,13 @@ class Operation:
             return csv_dataframe[self.source] * constant
 
     def _do_difference(self, csv_dataframe, constant=None, column=None, align=None, dtype=None):
-        source = csv_dataframe[self.source].to_numpy()
+        source = np.asarray(csv_dataframe[self.source])
 
         if constant is not None:
             return source - constant
 
         elif column is not None:
-            return source - csv_dataframe[column].array
+            return source - np.asarray(csv_dataframe[column])
 
         # else, produce a difference signal by subtracting adjacent values from one another
         diff = source[1:] - source[:-1]
@@ -238,6 +383,9 @@ class Operation:
     def build_operation(self, op_config):
         op_type = op_config['type']
         if op_type == 'lfilter':
+            if not SCIPY_AVAILABLE:
+                raise PlotTorqueProException("scipy is needed for lfilter operations")
+
             coeffs = op_config['coefficients']
             dtype = coeffs.get('dtype', 'float64')
             numerator = np.array(coeffs['numerator'], dtype=dtype)
@@ -274,10 +422,121 @@ class Operation:
                 return bind(self._do_difference, align=op_config.get('align'), dtype=op_config.get('dtype'))
 
         if op_type == 'convolution':
-            return bind(self._do_filter, bind(scipy.signal.convolve, in2=op_config['window']))
+            window = op_config['window']
+            if isinstance(window, (int, float)):
+                # a number is shorthand for a moving average that long
+                window = np.full(int(window), 1 / int(window))
+
+            return bind(self._do_filter,
+                        lfilter=bind(convolve, window=np.asarray(window, dtype='float64'),
+                                     offset=op_config.get('offset'), method=op_config.get('method', 'auto')))
 
         raise PlotTorqueProException(f"Unknown operation: {op_type}")
 
 
-def bind(method, *op_args, **op_kwargs):
-    return partial(method, *op_args, **op_kwargs)
+def bind(function, *op_args, **op_kwargs):
+    return partial(function, *op_args, **op_kwargs)
+
+
+def valid_runs(values, max_gap=0):
+    """
+    Returns the starts and stops of the runs of values that aren't NaN. Runs that are only max_gap or fewer NaNs apart
+    are joined into one run, so a joined run can have NaNs in it
+    """
+    valid = ~np.isnan(values)
+    edges = np.diff(valid.view(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    if max_gap and len(starts) > 1:
+        separate = starts[1:] - stops[:-1] > max_gap
+        starts = starts[np.concatenate([[True], separate])]
+        stops = stops[np.concatenate([separate, [True]])]
+
+    return starts, stops
+
+
+def filter_segments(values, function, max_gap=0):
+    """
+    Applies function to each run of values that aren't NaN separately, so that a NaN leaves a gap in the output rather
+    than making everything after it NaN
+
+    Runs separated by max_gap or fewer NaNs are filtered as one, skipping over the NaNs so that the filter's state
+    carries across the gap. The output is NaN wherever values is.
+    """
+    values = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(values)
+    if valid.all():
+        return function(values)
+
+    output = np.full(len(values), np.nan)
+    for start, stop in zip(*valid_runs(values, max_gap)):
+        run_valid = valid[start:stop]
+        if run_valid.all():
+            output[start:stop] = function(values[start:stop])
+        else:
+            output[start:stop][run_valid] = function(values[start:stop][run_valid])
+
+    return output
+
+
+def convolve(values, window, offset=None, method='auto'):
+    """
+    Convolves values with window and returns an array the same length as values
+
+    output[i] is element i + offset of the full convolution, so offset=0 gives a causal (trailing) filter and the
+    default offset of (len(window) - 1) // 2 centers the window on each sample. method is 'direct', 'fft',
+    'overlap-add', or 'auto' to choose based on the lengths of values and window.
+    """
+    values = np.asarray(values, dtype='float64')
+    window = np.asarray(window, dtype='float64')
+    offset = (len(window) - 1) // 2 if offset is None else int(offset)
+
+    if method == 'auto':
+        method = choose_convolution_method(len(values), len(window))
+    if method != 'direct' and not SCIPY_AVAILABLE:
+        raise PlotTorqueProException(f"scipy is needed for {method} convolution")
+
+    # a NaN only spoils the outputs whose window covers it when convolving directly, but an FFT spreads it to every
+    # output. So FFTs convolve with NaNs as zeros, and then those outputs are made NaN, to match direct convolution
+    missing = None
+    if method != 'direct' and np.isnan(values).any():
+        missing = np.isnan(values)
+        values = np.where(missing, 0.0, values)
+
+    if method == 'direct':
+        full = np.convolve(values, window)
+    elif method == 'fft':
+        full = scipy.signal.fftconvolve(values, window)
+    elif method == 'overlap-add':
+        full = scipy.signal.oaconvolve(values, window)
+    else:
+        raise PlotTorqueProException(f"Unknown convolution method: {method}")
+
+    if missing is not None:
+        # full[i] covers values[i - len(window) + 1:i + 1]
+        missing_before = np.concatenate([[0], np.cumsum(missing)])
+        ends = np.minimum(np.arange(len(full)), len(values) - 1) + 1
+        starts = np.maximum(np.arange(len(full)) - len(window) + 1, 0)
+        full[missing_before[ends] > missing_before[starts]] = np.nan
+
+    if 0 <= offset and offset + len(values) <= len(full):
+        return full[offset:offset + len(values)]
+
+    # the window was shifted past one of the ends, where the convolution is zero
+    output = np.zeros(len(values))
+    start, stop = max(offset, 0), min(offset + len(values), len(full))
+    output[start - offset:stop - offset] = full[start:stop]
+    return output
+
+
+def choose_convolution_method(n_values, n_window):
+    """ Picks the fastest convolution method for these lengths, preferring the exact direct method for short windows """
+    if not SCIPY_AVAILABLE or n_window <= DIRECT_CONVOLUTION_MAX or n_values * n_window <= DIRECT_CONVOLUTION_MAX_WORK:
+        return 'direct'
+
+    if n_values >= OVERLAP_ADD_MIN_RATIO * n_window:
+        return 'overlap-add'
+
+    return 'fft'
+
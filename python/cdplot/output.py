@@ -0,0 +1,281 @@
+"""
+Writes figures to html
+"""
+import base64
+import hashlib
+import json
+import logging
+import uuid
+from pathlib import Path
+
+import numpy as np
+import plotly.io.json
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+try:
+    import orjson  # noqa: F401
+    JSON_ENGINE = 'orjson'
+except ImportError:
+    JSON_ENGINE = 'json'
+
+logger = logging.getLogger(__name__)
+
+HTML_HEADER = """<html>
+<head><meta charset="utf-8" /></head>
+<body>
+    <div>
+        {plotlyjs}
+        <div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>
+        <script type="text/javascript">
+"""
+
+HTML_FOOTER = """
+        </script>
+    </div>
+</body>
+</html>
+"""
+
+# Typed arrays are decoded here rather than left to plotly.js, because older versions of plotly.js can't decode them.
+# Each shared x array is decoded once, and the same array is handed to every trace that uses it
+SCRIPT_HEADER = """(function() {
+    var arrayTypes = {f8: Float64Array, f4: Float32Array, i4: Int32Array, i2: Int16Array, i1: Int8Array,
+                      u4: Uint32Array, u2: Uint16Array, u1: Uint8Array};
+    function decode(spec) {
+        if (Array.isArray(spec)) return spec;
+        var bytes = atob(spec.bdata), buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) buffer[i] = bytes.charCodeAt(i);
+        var values = new arrayTypes[spec.dtype](buffer.buffer);
+        if (!spec.shape) return values;
+
+        // 2-d arrays, such as heatmap z, are an array of rows
+        var columns = Number(spec.shape.split(',')[1]), rows = [];
+        for (var start = 0; start < values.length; start += columns) rows.push(values.subarray(start, start + columns));
+        return rows;
+    }
+    function decodeAll(value) {
+        if (value === null || typeof value !== 'object') return value;
+        if (typeof value.bdata === 'string' && value.dtype) return decode(value);
+        for (var key in value) value[key] = decodeAll(value[key]);
+        return value;
+    }
+    var sharedX = [];
+    var data = [];
+"""
+
+SCRIPT_FOOTER = """    var layout = decodeAll({layout});
+    {x_index}.forEach(function(index, traceIndex) {{
+        if (index !== null) data[traceIndex].x = sharedX[index];
+    }});
+    var plot = Plotly.newPlot("{div_id}", data, layout, {config});
+{lazy}}})();"""
+
+# Traces that start out hidden in the legend are written to their own script files, which are only loaded once the
+# trace is shown. Script tags work from file:// urls, where fetch() doesn't
+LAZY_SCRIPT = """    var lazyTraces = {lazy_traces};
+    window.cdplotTraces = window.cdplotTraces || {{}};
+    window.cdplotTraces["{div_id}"] = function(index, update) {{
+        for (var key in update) update[key] = [decodeAll(update[key])];
+        Plotly.restyle("{div_id}", update, [index]);
+    }};
+    plot.then(function(gd) {{
+        gd.on('plotly_restyle', function() {{
+            gd.data.forEach(function(trace, index) {{
+                if (!(index in lazyTraces) || (trace.visible !== undefined && trace.visible !== true)) return;
+                var script = document.createElement('script');
+                script.src = lazyTraces[index];
+                delete lazyTraces[index];
+                document.head.appendChild(script);
+            }});
+        }});
+    }});
+"""
+
+# numpy dtypes that plotly.js can decode as typed arrays
+TYPED_ARRAY_DTYPES = {
+    'float64': 'f8',
+    'float32': 'f4',
+    'int32': 'i4',
+    'int16': 'i2',
+    'int8': 'i1',
+    'uint32': 'u4',
+    'uint16': 'u2',
+    'uint8': 'u1',
+}
+
+# base64 turns every 3 bytes into 4 characters, so encoding in multiples of 3 bytes can be done a piece at a time
+BASE64_CHUNK_BYTES = 3 * 2**20
+
+
+def write_html(fig, output_path, include_plotlyjs=True, div_id=None, config=None, lazy=False):
+    """
+    Writes fig to a standalone html file, like plotly's write_html() does, but streamed to the file a trace at a time
+
+    Numeric arrays are written as base64 typed arrays, which the page decodes before handing them to plotly.js. Traces
+    don't each carry their own copy of the x-axis data: each distinct x array is written once and shared by every trace
+    that uses it, and timestamps are written as milliseconds since the epoch rather than as date strings.
+
+    If lazy is true, the data of traces that start out hidden in the legend (visible='legendonly') is written to a
+    script file per trace, in a directory next to the html file, and only loaded once the trace is shown. Opening the
+    html file then only costs as much as the traces that are visible.
+    """
+    div_id = div_id or str(uuid.uuid4())
+    output_path = Path(output_path)
+    lazy_dir = output_path.parent / f'{output_path.stem}_traces'
+    lazy_traces = {}
+
+    with open(output_path, 'w', encoding='utf-8') as fh:
+        fh.write(HTML_HEADER.format(plotlyjs=_plotlyjs_tag(include_plotlyjs), div_id=div_id))
+        fh.write(SCRIPT_HEADER)
+
+        x_index = []
+        known_x = {}
+        date_axes = set()
+
+        for index, trace in enumerate(fig.data):
+            trace = trace.to_plotly_json()
+            x_values = trace.pop('x', None)
+            deferred = {} if lazy and trace.get('visible') == 'legendonly' else None
+
+            if x_values is None:
+                x_index.append(None)
+            else:
+                x_values, is_date = encode_x(x_values)
+                fingerprint = _fingerprint(x_values)
+                if fingerprint not in known_x and deferred is not None:
+                    # no trace that's shown has this x yet, so it's loaded along with this trace
+                    deferred['x'] = x_values
+                elif fingerprint not in known_x:
+                    known_x[fingerprint] = len(known_x)
+                    fh.write('    sharedX.push(decode(')
+                    write_json(fh, x_values)
+                    fh.write('));\n')
+
+                x_index.append(known_x[fingerprint] if fingerprint in known_x else None)
+                if is_date:
+                    date_axes.add('xaxis' + trace.get('xaxis', 'x')[1:])
+
+            if deferred is not None:
+                deferred.update({key: trace.pop(key) for key, value in list(trace.items())
+                                 if isinstance(value, np.ndarray)})
+                lazy_traces[index] = write_trace_script(lazy_dir, index, deferred, div_id)
+                # plotly.js hides a trace without any points from the legend too, so leave it a point of nothing
+                trace.update(dict.fromkeys(deferred, [None]))
+
+            fh.write('    data.push(decodeAll(')
+            write_json(fh, trace)
+            fh.write('));\n')
+
+        layout = fig.layout.to_plotly_json()
+        for axis_name in date_axes:
+            # plotly.js would guess that milliseconds are a linear axis
+            layout.setdefault(axis_name, {}).setdefault('type', 'date')
+
+        lazy_script = LAZY_SCRIPT.format(lazy_traces=json.dumps(lazy_traces), div_id=div_id) if lazy_traces else ''
+        fh.write(SCRIPT_FOOTER.format(layout=_to_json(layout), x_index=json.dumps(x_index), div_id=div_id,
+                                      config=json.dumps(config or dict(responsive=True)), lazy=lazy_script))
+        fh.write(HTML_FOOTER)
+
+
+def write_trace_script(lazy_dir, index, trace_data, div_id):
+    """ Writes a script that hands trace_data to the page once it loads. Returns its url relative to the html file """
+    lazy_dir.mkdir(exist_ok=True)
+    with open(lazy_dir / f'trace_{index}.js', 'w', encoding='utf-8') as fh:
+        fh.write(f'window.cdplotTraces["{div_id}"]({index}, ')
+        write_json(fh, trace_data)
+        fh.write(');\n')
+
+    return f'{lazy_dir.name}/trace_{index}.js'
+
+
+def encode_x(values):
+    """ Returns x values as a numpy array of floats, or as a list when they aren't numbers or timestamps """
+    values = np.asarray(values)
+
+    if values.dtype.kind == 'M':
+        nanoseconds = values.astype('datetime64[ns]').view(np.int64)
+        milliseconds = nanoseconds / 1e6
+        milliseconds[np.isnat(values)] = np.nan
+        return milliseconds, True
+
+    if values.dtype.kind in 'iubf':
+        return values.astype(np.float64), False
+
+    return values.tolist(), False
+
+
+def write_json(fh, value):
+    """ Writes value as JSON, with any numpy arrays in it written as typed arrays """
+    if isinstance(value, dict):
+        fh.write('{')
+        for index, (key, item) in enumerate(value.items()):
+            fh.write(',' if index else '')
+            fh.write(json.dumps(str(key)).replace('</', '<\\/'))
+            fh.write(':')
+            write_json(fh, item)
+        fh.write('}')
+
+    elif isinstance(value, (list, tuple)) and any(isinstance(item, (dict, np.ndarray)) for item in value):
+        fh.write('[')
+        for index, item in enumerate(value):
+            fh.write(',' if index else '')
+            write_json(fh, item)
+        fh.write(']')
+
+    elif isinstance(value, np.ndarray) and value.size and _typed_array_dtype(value) is not None:
+        write_typed_array(fh, value.astype(_typed_array_dtype(value), copy=False))
+
+    else:
+        fh.write(_to_json(value))
+
+
+def write_typed_array(fh, values):
+    values = np.ascontiguousarray(values)
+    fh.write(f'{{"dtype":"{TYPED_ARRAY_DTYPES[str(values.dtype)]}",')
+    if values.ndim > 1:
+        fh.write(f'"shape":"{", ".join(map(str, values.shape))}",')
+    fh.write('"bdata":"')
+
+    data = memoryview(values.reshape(-1)).cast('B')
+    for start in range(0, len(data), BASE64_CHUNK_BYTES):
+        fh.write(base64.b64encode(data[start:start + BASE64_CHUNK_BYTES]).decode('ascii'))
+
+    fh.write('"}')
+
+
+def _typed_array_dtype(values):
+    """ Returns the dtype values should be written as, or None if they can't be a typed array """
+    if str(values.dtype) in TYPED_ARRAY_DTYPES:
+        return values.dtype
+
+    if values.dtype.kind in 'iu' and len(values):
+        # plotly.js doesn't have 64-bit integers, so use the smallest integer type that fits
+        for dtype in ('int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32'):
+            info = np.iinfo(dtype)
+            if info.min <= values.min() and values.max() <= info.max:
+                return np.dtype(dtype)
+        return np.dtype('float64')
+
+    return None
+
+
+def _fingerprint(values):
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(values, np.ndarray):
+        digest.update(np.ascontiguousarray(values).view(np.uint8))
+    else:
+        digest.update(json.dumps(values, default=str).encode())
+    return digest.digest()
+
+
+def _to_json(value):
+    # a "</script>" in any string would end the script tag early
+    return plotly.io.json.to_json_plotly(value, engine=JSON_ENGINE).replace('</', '<\\/')
+
+
+def _plotlyjs_tag(include_plotlyjs):
+    if include_plotlyjs == 'cdn':
+        return f'<script charset="utf-8" src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"></script>'
+    if include_plotlyjs:
+        return f'<script type="text/javascript">{get_plotlyjs()}</script>'
+    return ''
@@ -0,0 +1,114 @@
+"""
+Overlays many sessions on one plot, each aligned to its own start
+"""
+import copy
+import logging
+
+import numpy as np
+import pandas
+import plotly.graph_objects as go
+
+from cdplot.data import map_sessions
+from cdplot.dataset import augment_session
+from cdplot.exceptions import PlotTorqueProException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POINTS = 2000
+
+
+def overlay(config):
+    """
+    Plots plot_torque_pro.overlay.y for every session as its own trace, against time since the start of the session
+
+    overlay.align can also name a column, such as a trip distance, to plot against that column's change since the start
+    of the session instead. Each session is read, filtered and decimated to at most overlay.points points in a worker
+    process, so the figure stays small no matter how long or how many the sessions are.
+    """
+    overlay_config = config['overlay']
+    if not overlay_config.get('y'):
+        raise PlotTorqueProException("plot_torque_pro.overlay.y is needed to know what to overlay")
+    if not config['data']['csv_path']:
+        raise ValueError("Nothing to plot")
+
+    results = map_sessions(align_session, config['data']['csv_path'], config, workers=config['data'].get('workers'))
+    sessions = [(index, source, x_values, y_values)
+                for index, (source, (x_values, y_values)) in enumerate(results) if len(x_values)]
+
+    align = overlay_config.get('align', 'time')
+    x_title = 'seconds since start' if align == 'time' else f'{align} since start'
+    return overlay_figure(sessions, overlay_config['y'], x_title)
+
+
+def align_session(session_path, config):
+    """ Returns (x relative to the start of the session, y), decimated to the point budget """
+    config = copy.deepcopy(config)
+    overlay_config = config['overlay']
+    y_axis = overlay_config['y']
+    align = overlay_config.get('align', 'time')
+
+    config['data']['require'].append(y_axis)
+    if align != 'time':
+        config['data']['require'].append(align)
+
+    csv_data = augment_session(session_path, config)
+    if csv_data is None:
+        return np.array([]), np.array([])
+
+    x_axis = csv_data.x or csv_data.columns[0]
+    x_values = csv_data[align if align != 'time' else x_axis]
+    if align == 'time' and x_values.dtype.kind == 'O':
+        # timestamps that read_csv wasn't asked to parse
+        x_values = pandas.to_datetime(x_values).to_numpy()
+
+    if x_values.dtype.kind == 'M':
+        x_values = (x_values - x_values[0]) / np.timedelta64(1, 's')
+    else:
+        x_values = x_values.astype('float64') - x_values[0]
+
+    # anything that isn't a number, like the "-" Torque logs before a PID has a value, is a gap
+    y_values = pandas.to_numeric(csv_data[y_axis], errors='coerce').astype('float64')
+    return decimate(x_values, y_values, overlay_config.get('points', DEFAULT_POINTS))
+
+
+def decimate(x_values, y_values, points):
+    """
+    Reduces x and y to about points points by keeping the min and max of y in each of points / 2 equal-sized buckets
+
+    Unlike taking every Nth point, this keeps the peaks, so the decimated line looks like the original.
+    """
+    n_values = len(y_values)
+    if n_values <= points:
+        return x_values, y_values
+
+    buckets = max(points // 2, 1)
+    bucket_size = -(-n_values // buckets)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n_values] = y_values
+    padded = padded.reshape(buckets, bucket_size)
+
+    missing = np.isnan(padded)
+    first_index = np.arange(buckets) * bucket_size
+    min_index = first_index + np.argmin(np.where(missing, np.inf, padded), axis=1)
+    max_index = first_index + np.argmax(np.where(missing, -np.inf, padded), axis=1)
+
+    # keep each bucket's min and max in their original order, and skip buckets that don't have any values
+    indices = np.sort(np.column_stack([min_index, max_index]), axis=1)
+    indices = indices[~missing.all(axis=1)].ravel()
+    indices = indices[np.concatenate([[True], np.diff(indices) != 0])]
+
+    return x_values[indices], y_values[indices]
+
+
+def overlay_figure(sessions, y_axis, x_title):
+    """ sessions is a list of (index, source, x values, y values). Uses WebGL traces so hundreds of lines stay fast """
+    traces = []
+    for index, source, x_values, y_values in sessions:
+        hovertemplate = f'session {index} ({source})<br>{x_title}=%{{x}}<br>{y_axis}=%{{y}}<extra></extra>'
+        traces.append(go.Scattergl(x=x_values, y=y_values, mode='lines', name=f'session {index}',
+                                   line=dict(width=1), opacity=0.6, hovertemplate=hovertemplate))
+
+    fig = go.Figure()
+    fig.add_traces(traces)
+    fig.update_layout(xaxis_title_text=x_title, yaxis_title_text=y_axis, legend_title_text='session')
+    return fig
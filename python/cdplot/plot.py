@@ -3,32 +3,193 @@ Reads and plots data from csv
 """
 import logging
 
+import numpy as np
+import pandas
 import plotly.express
+import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from .columns import ColumnStore
 from .exceptions import PlotTorqueProException
 from .functional import lfilter
 
 logger = logging.getLogger(__name__)
 
+# plot parameters that line_plot() knows how to handle. Anything else goes to plotly.express.line()
+LINE_PLOT_PARAMETERS = {'x', 'y', 'title', 'template', 'width', 'height'}
+
+DEFAULT_BINS = 200
+AGGREGATES = {
+    'sum': None,
+    'mean': None,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
 
 def render_plot(csv_data, plot_config):
     configure_axes(csv_data, plot_config)
 
+    plot_type = plot_config.pop('type', None) or 'line'
     y2 = plot_config.pop('y2', None)
     hovertemplate = plot_config.pop('hovertemplate', None)
     hovermode = plot_config.pop('hovermode', None)
+    visible = plot_config.pop('visible', None)
+
+    if plot_type == 'density':
+        fig = density_plot(csv_data, y2=y2, **plot_config)
 
-    fig = plotly.express.line(csv_data, **plot_config)
+    elif plot_type != 'line':
+        raise PlotTorqueProException(f"Unknown plot type: {plot_type}")
 
-    if y2:
-        fig = plot_twin_x(csv_data, fig, y2=y2, **plot_config)
+    elif isinstance(csv_data, ColumnStore) and set(plot_config) <= LINE_PLOT_PARAMETERS:
+        fig = line_plot(csv_data, y2=y2, **plot_config)
+
+    else:
+        if isinstance(csv_data, ColumnStore):
+            csv_data = csv_data.to_dataframe()
+        fig = plotly.express.line(csv_data, **plot_config)
+
+        if y2:
+            fig = plot_twin_x(csv_data, fig, y2=y2, **plot_config)
 
     if hovertemplate:
         fig.update_traces(hovertemplate=hovertemplate)
     if hovermode:
         fig.update_layout(hovermode=hovermode)
+    if visible is not None:
+        # everything else starts out hidden, but can still be turned on from the legend
+        fig.for_each_trace(lambda trace: trace.update(visible='legendonly'),
+                           selector=lambda trace: trace.name not in visible)
+
+    return fig
+
+
+def line_plot(csv_data, x, y, y2=None, **layout):
+    """
+    Makes the same figure as plotly.express.line() does with wide-form data, but straight from the ColumnStore arrays
+
+    plotly.express melts wide-form data into a long-form DataFrame first, which repeats the x column once per y column.
+    """
+    fig = make_subplots(specs=[[dict(secondary_y=True)]]) if y2 else go.Figure()
+
+    x_values = csv_data[x]
+    traces = [line_trace(x, x_values, column, csv_data[column]) for column in y]
+    for column in y2 or []:
+        traces.append(line_trace(x, x_values, column, csv_data[column], yaxis='y2'))
+    fig.add_traces(traces)
+
+    fig.update_layout(xaxis_title_text=x, yaxis_title_text='value', legend_title_text='variable',
+                      legend_tracegroupgap=0, margin=dict(t=60), **layout)
+    return fig
+
+
+def line_trace(x, x_values, column, values, **trace_args):
+    hovertemplate = f'variable={column}<br>{x}=%{{x}}<br>value=%{{y}}<extra></extra>'
+    return go.Scatter(x=x_values, y=values, mode='lines', name=column, legendgroup=column, showlegend=True,
+                      hovertemplate=hovertemplate, **trace_args)
+
+
+def density_plot(csv_data, x, y, y2=None, bins=DEFAULT_BINS, log=False, z=None, aggregate='mean', **layout):
+    """
+    Plots y against x as a 2D histogram, as a single heatmap trace
+
+    Instead of a marker per row, rows are counted into bins x bins cells (bins can also be [x bins, y bins]), so the
+    size of the figure depends on the number of bins rather than the number of rows. log shows log10 of the counts,
+    and z colours each cell by an aggregate (sum, mean, min or max) of that column instead of by the count. Rows with a
+    missing or infinite x, y or z are left out.
+    """
+    if y2 or len(y) != 1:
+        raise PlotTorqueProException("A density plot needs exactly one y column")
+    if aggregate not in AGGREGATES:
+        raise PlotTorqueProException(f"Unknown density aggregate: {aggregate}")
+    y = y[0]
+    x_bins, y_bins = (bins, bins) if np.isscalar(bins) else (bins[0], bins[-1])
+
+    x_values, x_is_date = _density_values(csv_data[x])
+    y_values, y_is_date = _density_values(csv_data[y])
+    z_values = None if z is None else _density_values(csv_data[z])[0]
+
+    # infinities (Torque's ∞) can't be binned, and would stretch the bins to cover them
+    present = np.isfinite(x_values) & np.isfinite(y_values)
+    if z_values is not None:
+        present &= np.isfinite(z_values)
+        z_values = z_values[present]
+    x_values, y_values = x_values[present], y_values[present]
+
+    x_index, x_edges = _bin_index(x_values, x_bins)
+    y_index, y_edges = _bin_index(y_values, y_bins)
+    cells = y_index * x_bins + x_index
+
+    counts = np.bincount(cells, minlength=x_bins * y_bins).astype(np.float64)
+    if z_values is None:
+        cell_values = counts
+        colorbar_title = 'count'
+    elif AGGREGATES[aggregate] is None:
+        cell_values = np.bincount(cells, weights=z_values, minlength=x_bins * y_bins)
+        if aggregate == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cell_values = cell_values / counts
+        colorbar_title = f'{aggregate}({z})'
+    else:
+        cell_values = np.full(x_bins * y_bins, np.inf if aggregate == 'min' else -np.inf)
+        AGGREGATES[aggregate].at(cell_values, cells, z_values)
+        colorbar_title = f'{aggregate}({z})'
+
+    # empty cells are left blank rather than coloured as zero
+    cell_values[counts == 0] = np.nan
+    if log:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cell_values = np.log10(cell_values)
+        colorbar_title = f'log10({colorbar_title})'
+
+    hovertemplate = f'{x}=%{{x}}<br>{y}=%{{y}}<br>{colorbar_title}=%{{z}}<extra></extra>'
+    trace = go.Heatmap(x=_bin_centres(x_edges, x_is_date), y=_bin_centres(y_edges, y_is_date),
+                       z=cell_values.reshape(y_bins, x_bins), colorbar_title_text=colorbar_title,
+                       hovertemplate=hovertemplate)
+
+    fig = go.Figure(trace)
+    fig.update_layout(xaxis_title_text=x, yaxis_title_text=y, margin=dict(t=60), **layout)
+    return fig
+
+
+def _density_values(values):
+    """ Returns (values as float64, whether they were timestamps). Anything that isn't a number becomes NaN """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        nanoseconds = values.astype('datetime64[ns]')
+        floats = nanoseconds.view(np.int64).astype(np.float64)
+        floats[np.isnat(nanoseconds)] = np.nan
+        return floats, True
+    if values.dtype.kind == 'O':
+        values = pandas.to_numeric(values, errors='coerce')
+    return np.asarray(values, dtype=np.float64), False
+
+
+def _bin_index(values, bins):
+    """ Returns (the bin each value falls in, the bin edges) for bins equal-width bins spanning values """
+    low, high = (values.min(), values.max()) if len(values) else (0.0, 1.0)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+
+    edges = np.linspace(low, high, bins + 1)
+    index = ((values - low) * (bins / (high - low))).astype(np.intp)
+    # the maximum belongs in the last bin rather than one past it
+    np.clip(index, 0, bins - 1, out=index)
+    return index, edges
+
+
+def _bin_centres(edges, is_date):
+    centres = (edges[:-1] + edges[1:]) / 2
+    if is_date:
+        return centres.astype(np.int64).astype('datetime64[ns]')
+    return centres
+
 
+def mark_preview(fig, rows):
+    """ Labels fig as a preview, so a sample is never mistaken for the whole log """
+    fig.add_annotation(text=f'PREVIEW: a sample of about {rows} rows per file', xref='paper', yref='paper', x=1, y=1,
+                       xanchor='right', yanchor='bottom', showarrow=False, font=dict(color='firebrick'))
     return fig
 
 
@@ -0,0 +1,125 @@
+"""
+Summarizes many sessions at once, with a row of statistics per session instead of a plot of every sample
+"""
+import logging
+import re
+import warnings
+
+import numpy as np
+import pandas
+import plotly.graph_objects as go
+
+from cdplot.data import map_sessions
+from cdplot.dataset import augment_session
+from cdplot.exceptions import PlotTorqueProException
+from cdplot.export import write_table
+from cdplot.output import write_html
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATISTICS = ['count', 'min', 'max', 'mean', 'std', 'p5', 'p50', 'p95']
+STATISTIC_FUNCTIONS = {
+    'count': lambda values: np.sum(~np.isnan(values), axis=0),
+    'min': lambda values: np.nanmin(values, axis=0),
+    'max': lambda values: np.nanmax(values, axis=0),
+    'mean': lambda values: np.nanmean(values, axis=0),
+    'std': lambda values: np.nanstd(values, axis=0),
+    'sum': lambda values: np.nansum(values, axis=0),
+}
+PERCENTILE_PATTERN = re.compile(r'p(\d+(\.\d+)?)$')
+
+
+def summarize(config):
+    """
+    Computes statistics for every session in every csv file, and writes them to plot_torque_pro.summary.output_path
+
+    Each session is read, filtered and summarized in its own worker process, so only one session per worker is ever in
+    memory. Returns the table of statistics, with a row per session.
+    """
+    summary_config = config['summary']
+    statistics = summary_config.get('statistics') or DEFAULT_STATISTICS
+    for statistic in statistics:
+        if statistic not in STATISTIC_FUNCTIONS and not PERCENTILE_PATTERN.match(statistic):
+            raise PlotTorqueProException(f"Unknown statistic: {statistic}")
+
+    if not config['data']['csv_path']:
+        raise ValueError("Nothing to summarize")
+
+    results = map_sessions(summarize_session, config['data']['csv_path'], config, statistics,
+                           workers=config['data'].get('workers'))
+    table = pandas.DataFrame([dict(session=index, source=str(source), **row)
+                              for index, (source, row) in enumerate(results)])
+    if summary_config.get('output_path'):
+        write_table(table, summary_config['output_path'])
+        logger.info("Written to %s", str(summary_config['output_path']))
+
+    if summary_config.get('figure_path'):
+        fig = overview_figure(table, summary_config.get('figure_statistic', 'mean'))
+        write_html(fig, summary_config['figure_path'])
+        logger.info("Written to %s", str(summary_config['figure_path']))
+
+    return table
+
+
+def summarize_session(session_path, config, statistics):
+    """ Reads, filters and summarizes one session. Returns a dictionary that makes up one row of the summary """
+    csv_data = augment_session(session_path, config)
+    if csv_data is None:
+        return dict(rows=0)
+
+    row = dict(rows=len(csv_data))
+    x_axis = csv_data.x or (csv_data.columns[0] if csv_data.columns else None)
+    if x_axis is not None:
+        x_values = csv_data[x_axis]
+        row.update(start=x_values[0], end=x_values[-1])
+        if x_values.dtype.kind == 'M':
+            row['duration_s'] = (x_values[-1] - x_values[0]) / np.timedelta64(1, 's')
+
+    columns = [column for column in csv_data.columns if column != x_axis and csv_data[column].dtype.kind in 'iufb']
+    if not columns:
+        return row
+
+    # one 2-d array means each statistic is a single vectorized call for all of the columns
+    values = np.column_stack([csv_data[column].astype('float64', copy=False) for column in columns])
+    for statistic, results in session_statistics(values, statistics).items():
+        row.update({f'{column} {statistic}': result for column, result in zip(columns, results)})
+
+    return row
+
+
+def session_statistics(values, statistics):
+    """ Returns {statistic: array of that statistic for each column of values} """
+    percentiles = {statistic: float(PERCENTILE_PATTERN.match(statistic).group(1))
+                   for statistic in statistics if statistic not in STATISTIC_FUNCTIONS}
+
+    # all-NaN columns are expected, and just give NaN statistics
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        results = {statistic: STATISTIC_FUNCTIONS[statistic](values)
+                   for statistic in statistics if statistic in STATISTIC_FUNCTIONS}
+        if percentiles:
+            percentile_values = np.nanpercentile(values, list(percentiles.values()), axis=0)
+            results.update(zip(percentiles, percentile_values))
+
+    return {statistic: results[statistic] for statistic in statistics}
+
+
+def overview_figure(table, statistic='mean'):
+    """ Plots one statistic of each column against the start of each session, with min/max as error bars """
+    x_values = table['start'] if 'start' in table else table['session']
+    fig = go.Figure()
+
+    suffix = f' {statistic}'
+    for name in [column for column in table.columns if column.endswith(suffix)]:
+        column = name[:-len(suffix)]
+        error_y = None
+        if f'{column} min' in table and f'{column} max' in table:
+            error_y = dict(type='data', array=table[f'{column} max'] - table[name],
+                           arrayminus=table[name] - table[f'{column} min'])
+
+        fig.add_trace(go.Scatter(x=x_values, y=table[name], mode='lines+markers', name=column, error_y=error_y))
+
+    fig.update_layout(xaxis_title_text='session', yaxis_title_text=statistic, legend_title_text='variable')
+    return fig
+
@@ -0,0 +1,218 @@
+"""
+Parses the timestamp columns in Torque logs
+"""
+import calendar
+import logging
+import re
+
+import numpy as np
+import pandas
+
+logger = logging.getLogger(__name__)
+
+# columns that are parsed when plot_torque_pro.data.timestamps isn't set
+TORQUE_TIME_COLUMNS = ['Device Time', 'GPS Time']
+
+# Where each field is in the fixed-width timestamp strings Torque writes. Negative positions count from the end of the
+# string, because the time zone in GPS Time isn't always the same length
+TORQUE_LAYOUTS = {
+    # 18-Oct-2023 08:12:45.000
+    '%d-%b-%Y %H:%M:%S.%f': dict(
+        length=24, separators={2: '-', 6: '-', 11: ' ', 14: ':', 17: ':', 20: '.'},
+        fields=dict(day=(0, 2), month=(3, 6), year=(7, 11), hour=(12, 14), minute=(15, 17), second=(18, 20),
+                    millisecond=(21, 24)),
+    ),
+    # Wed Oct 18 08:12:45 PDT 2023
+    '%a %b %d %H:%M:%S %Z %Y': dict(
+        length=None, separators={3: ' ', 7: ' ', 10: ' ', 13: ':', 16: ':', 19: ' ', -5: ' '},
+        fields=dict(month=(4, 7), day=(8, 10), hour=(11, 13), minute=(14, 16), second=(17, 19), year=(-4, None)),
+        zone=(20, -5),
+    ),
+}
+
+# UTC offsets in minutes of the time zone abbreviations Java (and so Torque) writes. Torque also writes GMT+01:00 and
+# the like for zones without an abbreviation. Where an abbreviation is ambiguous, it's the North American zone
+ZONE_OFFSETS = dict(
+    UTC=0, UT=0, GMT=0, Z=0, WET=0, WEST=60, BST=60, CET=60, CEST=120, EET=120, EEST=180, MSK=180,
+    NST=-210, NDT=-150, AST=-240, ADT=-180, EST=-300, EDT=-240, CST=-360, CDT=-300, MST=-420, MDT=-360, PST=-480,
+    PDT=-420, AKST=-540, AKDT=-480, HST=-600,
+    JST=540, KST=540, AWST=480, ACST=570, ACDT=630, AEST=600, AEDT=660, NZST=720, NZDT=780,
+)
+ZONE_OFFSET_PATTERN = re.compile(r'(?:GMT|UTC)([+-])(\d{1,2}):?(\d{2})?$')
+
+FIELD_RANGES = dict(year=(1970, 9999), month=(1, 12), day=(1, 31), hour=(0, 23), minute=(0, 59), second=(0, 60),
+                    millisecond=(0, 999))
+
+# month abbreviations as 3-byte integers, so they can be looked up with searchsorted()
+MONTH_KEYS = np.array([int.from_bytes(name.encode('ascii'), 'big') for name in calendar.month_abbr[1:]])
+MONTH_ORDER = np.argsort(MONTH_KEYS)
+
+# epoch timestamps bigger than this are milliseconds rather than seconds (it's 1973 in milliseconds)
+EPOCH_MILLISECONDS_MIN = 1e11
+
+
+def parse_timestamps(csv_dataframe, config):
+    """
+    Parses timestamp columns in-place, so that they're datetime64 rather than strings
+
+    The columns are plot_torque_pro.data.timestamps, which defaults to Torque's time columns. Numeric columns are taken
+    to be epoch seconds or milliseconds. Strings in one of Torque's own formats are parsed by slicing the fields out
+    of every string at once, and strings in plot_torque_pro.data.date_format (a format, or a table of formats by
+    column) are parsed by pandas with that fixed format, so the format is never inferred.
+
+    Timestamps with a time zone in them, like GPS Time, are converted to UTC, so that they stay in order when the zone
+    changes (at the end of daylight saving time, say).
+    """
+    columns = config.get('timestamps')
+    columns = TORQUE_TIME_COLUMNS if columns is None else columns
+    date_format = config.get('date_format')
+
+    for column in columns:
+        if column not in csv_dataframe or csv_dataframe[column].dtype.kind == 'M':
+            continue
+
+        column_format = date_format.get(column) if isinstance(date_format, dict) else date_format
+        timestamps = parse_timestamp_column(csv_dataframe[column], column_format)
+        if timestamps is None:
+            logger.warning("Couldn't parse %s as timestamps, so it's left as it is", column)
+        else:
+            csv_dataframe[column] = timestamps
+
+    return csv_dataframe
+
+
+def parse_timestamp_column(values, date_format=None):
+    """ Returns values as a datetime64[ns] array, or None if they aren't in a format that's known """
+    if values.dtype.kind in 'iuf':
+        values = values.to_numpy(dtype=np.float64)
+        unit = 'ms' if np.nanmax(np.abs(values), initial=0) >= EPOCH_MILLISECONDS_MIN else 's'
+        return pandas.to_datetime(values, unit=unit).to_numpy(dtype='datetime64[ns]')
+
+    present = values.notna().to_numpy()
+    strings = values.to_numpy(dtype=object)
+    if not present.any():
+        return None
+
+    formats = [date_format] if date_format else list(TORQUE_LAYOUTS)
+    for candidate in formats:
+        if candidate in TORQUE_LAYOUTS:
+            timestamps = parse_layout(strings, present, TORQUE_LAYOUTS[candidate])
+            if timestamps is not None:
+                return timestamps
+
+    if date_format:
+        # not one of Torque's formats, but pandas can still parse a fixed format much faster than guessing
+        return pandas.to_datetime(strings, format=date_format, errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+    return None
+
+
+def parse_layout(strings, present, layout):
+    """ Parses fixed-width strings by their layout. Returns None if any of them don't match it """
+    # fill in missing values with a string that's known to parse, and mark them NaT afterwards
+    filled = strings.copy()
+    filled[~present] = strings[present][0]
+
+    try:
+        raw = filled.astype(bytes)
+    except (UnicodeEncodeError, TypeError):
+        return None
+
+    chars = raw.view(np.uint8).reshape(len(raw), raw.dtype.itemsize)
+    lengths = np.char.str_len(raw)
+    if layout['length'] is not None and np.any(lengths != layout['length']):
+        return None
+    if np.any(lengths < 20):
+        # too short to be any of the layouts, and fields from the end of the string would wrap around
+        return None
+
+    rows = np.arange(len(raw))[:, np.newaxis]
+
+    def field(start, stop):
+        if start >= 0:
+            return chars[:, start:stop]
+        return chars[rows, lengths[:, np.newaxis] + np.arange(start, stop or 0)]
+
+    for position, separator in layout['separators'].items():
+        if np.any(field(position, position + 1 or None)[:, 0] != ord(separator)):
+            return None
+
+    values = {}
+    for name, (start, stop) in layout['fields'].items():
+        if name == 'month':
+            values[name] = _month_numbers(field(start, stop))
+        else:
+            digits = field(start, stop).astype(np.int64) - ord('0')
+            if np.any((digits < 0) | (digits > 9)):
+                return None
+            values[name] = digits @ 10 ** np.arange(digits.shape[1] - 1, -1, -1)
+
+        if values[name] is None:
+            return None
+        low, high = FIELD_RANGES[name]
+        if np.any((values[name] < low) | (values[name] > high)):
+            return None
+
+    months = (values['year'] - 1970) * 12 + values['month'] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (values['day'] - 1)
+    seconds = (values['hour'] * 60 + values['minute']) * 60 + values['second']
+    nanoseconds = seconds * 10**9 + values.get('millisecond', 0) * 10**6
+
+    if 'zone' in layout:
+        offsets = _zone_offsets(chars, lengths, *layout['zone'])
+        if offsets is None:
+            return None
+        nanoseconds -= offsets * 60 * 10**9
+
+    timestamps = days.astype('datetime64[ns]') + nanoseconds.astype('timedelta64[ns]')
+    timestamps[~present] = np.datetime64('NaT')
+    return timestamps
+
+
+def _zone_offsets(chars, lengths, start, stop):
+    """
+    Returns the UTC offset in minutes of the time zone in each row, which is between start and stop (from the end).
+    An unknown zone is left as it is if it's the only zone, and otherwise the result is None
+    """
+    width = max(int(lengths.max()) + stop - start, 1)
+    zone_chars = np.zeros((len(chars), width), dtype=np.uint8)
+    columns = np.arange(width)
+    in_zone = columns < (lengths + stop - start)[:, np.newaxis]
+    zone_chars[in_zone] = chars[:, start:start + width][in_zone]
+    zones = zone_chars.view(f'S{width}').ravel()
+
+    # the zone only changes now and then, so only look up the zone at the start of each run of the same zone
+    run_starts = np.concatenate([[0], np.flatnonzero(zones[1:] != zones[:-1]) + 1])
+    names = [zone.decode('ascii', errors='replace') for zone in zones[run_starts]]
+    run_offsets = [zone_offset(name) for name in names]
+
+    if None in run_offsets:
+        if len(set(names)) > 1:
+            return None
+        logger.warning("Unknown time zone %s, so timestamps are left in that zone", names[0])
+        return np.zeros(len(chars), dtype=np.int64)
+
+    return np.repeat(np.array(run_offsets, dtype=np.int64), np.diff(np.append(run_starts, len(chars))))
+
+
+def zone_offset(zone):
+    """ Returns the UTC offset in minutes of a time zone abbreviation or GMT+hh:mm, or None if it isn't known """
+    if zone in ZONE_OFFSETS:
+        return ZONE_OFFSETS[zone]
+
+    match = ZONE_OFFSET_PATTERN.match(zone)
+    if match is None:
+        return None
+    sign, hours, minutes = match.groups()
+    offset = int(hours) * 60 + int(minutes or 0)
+    return -offset if sign == '-' else offset
+
+
+def _month_numbers(chars):
+    """ Returns 1-12 for each row of 3-character month abbreviations, or None if any of them aren't months """
+    keys = chars.astype(np.int64) @ np.array([1 << 16, 1 << 8, 1])
+    positions = np.searchsorted(MONTH_KEYS[MONTH_ORDER], keys).clip(0, 11)
+    months = MONTH_ORDER[positions]
+    if np.any(MONTH_KEYS[months] != keys):
+        return None
+    return months + 1
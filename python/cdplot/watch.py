@@ -0,0 +1,108 @@
+"""
+Keeps a plot up to date while its config file or csv files are being edited
+"""
+import copy
+import json
+import logging
+import os
+import time
+
+from cdplot.config import figure_configs, process_config
+from cdplot.dataset import Dataset
+from cdplot.exceptions import PlotTorqueProException
+from cdplot.output import write_html
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.5
+
+# data parameters that change what's read from the csv files. Changing anything else only reruns filters or the plot
+READ_PARAMETERS = ('csv_path', 'session', 'preview', 'read_csv', 'default_type', 'timestamps', 'date_format', 'dropna',
+                   'dropna_threshold', 'fillna')
+
+
+class Watcher:
+    """
+    Renders the plot described by a config file again whenever the config file or the csv files it reads change
+
+    The csv data is kept in memory, and only read again when the csv files or the parameters for reading them change.
+    Filter outputs are remembered by their operation config, so editing a filter only reruns that filter and the filters
+    that use its output, and editing the plot section only renders the figure again.
+    """
+
+    def __init__(self, config_path=None, **config_args):
+        self.config_path = config_path
+        self.config_args = config_args
+        self.dataset = None
+        self._read_key = None
+        self._modified = None
+
+    def watch(self, interval=DEFAULT_INTERVAL):
+        """ Polls for changes every interval seconds until interrupted """
+        # a broken config to start with is reported straight away rather than waited on
+        self.update()
+        logger.info("Watching for changes. Press Ctrl+C to stop")
+
+        try:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.update()
+                except Exception:
+                    # most likely a half-edited config. Keep watching, and try again after the next change
+                    logger.exception("Rendering failed")
+        except KeyboardInterrupt:
+            pass
+
+    def update(self):
+        """ Renders the plot if anything changed since the last update(). Returns whether it did """
+        modified = self._modified_times(self._watched_paths())
+        if modified == self._modified:
+            return False
+        self._modified = modified
+
+        start = time.perf_counter()
+        config = process_config(self.config_path, **copy.deepcopy(self.config_args))
+        if not all(figure_config.get('output_path') for figure_config in figure_configs(config)):
+            raise PlotTorqueProException("Watching needs an output_path to keep up to date")
+
+        read_key = self._read_key_of(config)
+        if self.dataset is None or read_key != self._read_key:
+            logger.info("Reading csv data")
+            self.dataset = Dataset(config)
+            self._read_key = read_key
+            # the csv files may have changed too
+            self._modified = self._modified_times(self._watched_paths())
+        else:
+            self.dataset.config = config
+
+        for figure_config, fig in self.dataset.render_figures(workers=config['data'].get('workers')):
+            write_html(fig, figure_config['output_path'], lazy=figure_config.get('lazy_traces', False))
+            logger.info("Written to %s", str(figure_config['output_path']))
+        # otherwise the outputs of every version of every filter would be kept for as long as this runs
+        self.dataset.prune_results()
+
+        logger.info("Done in %.2fs", time.perf_counter() - start)
+        return True
+
+    def _watched_paths(self):
+        paths = [self.config_path] if self.config_path is not None else []
+        if self.dataset is not None:
+            paths.extend(self.dataset.config['data']['csv_path'] or [])
+        return paths
+
+    def _read_key_of(self, config):
+        read_config = {key: config['data'].get(key) for key in READ_PARAMETERS}
+        csv_paths = config['data']['csv_path'] or []
+        return json.dumps([read_config, self._modified_times(csv_paths)], sort_keys=True, default=str)
+
+    @staticmethod
+    def _modified_times(paths):
+        modified = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                modified.append((str(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                modified.append((str(path), None, None))
+        return modified
@@ -0,0 +1,11 @@
+"""
+How many threads or processes to use by default
+"""
+import os
+
+
+def available_cpus():
+    """ The cpus this process can run on, which in a container can be fewer than os.cpu_count() """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.cache """
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas
+
+from cdplot.cache import OperationCache, fingerprint_column
+from cdplot.dataset import Dataset
+from cdplot.filters import Operation, process_data
+
+
+def make_dataframe():
+    return pandas.DataFrame(dict(a=np.arange(5.0), b=np.ones(5)))
+
+
+def make_operations():
+    return [Operation(dict(source='a', destination='tmp', type='sum', column='b')),
+            Operation(dict(source='tmp', destination='out', type='product', constant=2))]
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = OperationCache(tmp_path)
+    dataframe = make_dataframe()
+    process_data(dataframe, make_operations(), cache=cache)
+    assert len(list(tmp_path.glob('*.npy'))) == 2
+
+    # cached outputs are used on the next run
+    for path in tmp_path.glob('*.npy'):
+        np.save(path, np.full(5, 7.0))
+    dataframe = make_dataframe()
+    process_data(dataframe, make_operations(), cache=OperationCache(tmp_path))
+    assert list(dataframe['out']) == [7] * 5
+
+
+def test_cache_input_changed(tmp_path):
+    process_data(make_dataframe(), make_operations(), cache=OperationCache(tmp_path))
+
+    # different input data means different keys
+    dataframe = make_dataframe()
+    dataframe['a'] += 1
+    process_data(dataframe, make_operations(), cache=OperationCache(tmp_path))
+    assert list(dataframe['out']) == [4, 6, 8, 10, 12]
+    assert len(list(tmp_path.glob('*.npy'))) == 4
+
+
+def test_cache_dataset(tmp_path, monkeypatch):
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        fh.write("Device Time, Engine RPM(rpm), Speed (OBD)(km/h)\n")
+        for index in range(20):
+            fh.write(f"18-Oct-2023 08:12:{index:02d}.000,{1000 + index},{index}\n")
+
+    def augment():
+        dataset = Dataset.from_csv(csv_path, x='Device Time', cache_dir=str(tmp_path / 'cache'))
+        dataset.config['data']['filters'] = [dict(source='Engine RPM(rpm)', destination='Smooth RPM', type='average',
+                                                  coefficients=3)]
+        return dataset.augment()
+
+    first = augment()
+    assert len(list((tmp_path / 'cache').glob('*.npy'))) == 1
+
+    # the second run loads the output from the cache, memory-mapped, instead of computing it again
+    monkeypatch.setattr(Operation, 'compute', None)
+    second = augment()
+    # outputs are mapped read-only, where a computed output would be writeable
+    assert not second['Smooth RPM'].flags.writeable
+    assert np.array_equal(first['Smooth RPM'], second['Smooth RPM'])
+
+
+def test_fingerprint_column():
+    # a ColumnStore's columns are numpy arrays, and a DataFrame's are Series
+    for values in (np.arange(5.0), np.array(['a', None, 'c'], dtype=object)):
+        assert fingerprint_column(values) == fingerprint_column(pandas.Series(values))
+    assert fingerprint_column(np.arange(5.0)) != fingerprint_column(np.arange(1.0, 6.0))
+
+
+def test_cache_eviction(tmp_path):
+    cache = OperationCache(tmp_path, max_bytes=2000)
+    for index in range(5):
+        cache.put(f'key{index}', np.full(100, float(index)))
+
+    # each entry is a little over 800 bytes, so only the two most recent fit
+    assert cache.get('key0') is None
+    assert cache.get('key3') is not None
+    assert cache.get('key4') is not None
+    assert sum(path.stat().st_size for path in tmp_path.glob('*.npy')) <= 2000
+
+
+def test_cache_in_use(tmp_path, monkeypatch):
+    cache = OperationCache(tmp_path, max_bytes=2000)
+    for index in range(2):
+        cache.put(f'key{index}', np.full(100, float(index)))
+
+    # on Windows, memory-mapped outputs can't be deleted or replaced
+    in_use = cache._path('key0')
+    unlink = Path.unlink
+    replace = os.replace
+
+    def unlink_unless_in_use(path, *args, **kwargs):
+        if path == in_use:
+            raise PermissionError(f"{path} is in use")
+        return unlink(path, *args, **kwargs)
+
+    def replace_unless_in_use(source, destination):
+        if Path(destination) == in_use:
+            raise PermissionError(f"{destination} is in use")
+        return replace(source, destination)
+
+    monkeypatch.setattr(Path, 'unlink', unlink_unless_in_use)
+    monkeypatch.setattr(os, 'replace', replace_unless_in_use)
+
+    # the output that's in use is skipped, and the next least recently used is evicted instead
+    cache.put('key2', np.full(100, 2.0))
+    assert cache.get('key0') is not None
+    assert cache.get('key1') is None
+
+    cache.put('key0', np.full(100, 0.0))
+    assert list(tmp_path.glob('*.tmp')) == []
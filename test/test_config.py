@@ -3,7 +3,7 @@
 """ Unit tests for plot_torque_pro.config """
 from pathlib import Path
 
-from cdplot.config import determine_columns, normalize_config, merge_configs
+from cdplot.config import determine_columns, figure_configs, normalize_config, merge_configs
 
 
 def test_merge_configs():
@@ -180,3 +180,23 @@ def test_normalize_config_xaxis():
     config = dict(data=dict(csv_path="", require=[], exclude=['a']), plot=dict(x='a'))
     normalize_config(config)
     assert config == dict(data=dict(csv_path=[Path('.')], exclude=['a'], require=['a']), plot=dict(x='a'))
+
+
+def test_figure_configs():
+    config = dict(output_path=Path('main.html'), data=dict(csv_path=[Path('log.csv')], require=['a'], exclude=['c']),
+                  plot=dict(x='a', title='Trip'))
+    assert figure_configs(config) == [config]
+
+    config['plots'] = [dict(output_path=Path('engine.html'), y=['b']), dict(output_path=Path('fuel.html'), x='d',
+                                                                          include=['d', 'e'])]
+    engine, fuel = figure_configs(config)
+    assert engine['output_path'] == Path('engine.html')
+    assert engine['plot'] == dict(x='a', y=['b'], title='Trip')
+    assert engine['data']['exclude'] == ['c']
+    assert fuel['plot'] == dict(x='d', title='Trip')
+    assert fuel['data']['include'] == ['d', 'e']
+    assert 'plots' not in fuel
+
+    # the sections don't share anything with the config, or with each other
+    fuel['data']['exclude'].append('e')
+    assert config['data']['exclude'] == ['c'] and engine['data']['exclude'] == ['c']
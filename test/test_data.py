@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.data """
+import bz2
+import gzip
+import lzma
+import zipfile
+
+import pandas
+import pytest
+
+from cdplot.data import detect_compression, load_from_csv, open_csv, preprocess_data, ZipMember
+
+HEADER = "GPS Time, Device Time, Longitude, Latitude, Engine RPM(rpm), Speed (OBD)(km/h)\n"
+ROWS = [
+    "Wed Oct 18 08:12:45 PDT 2023,18-Oct-2023 08:12:45.000,-122.3301,47.6062,812.5,0.0\n",
+    "Wed Oct 18 08:12:46 PDT 2023,18-Oct-2023 08:12:45.500,-122.3302,47.6061,-,1.5\n",
+    "Wed Oct 18 08:12:46 PDT 2023,18-Oct-2023 08:12:46.000,-122.3303,47.6060,∞,3.0\n",
+]
+TWO_SESSIONS = HEADER + ''.join(ROWS) + HEADER + ''.join(ROWS[:2])
+
+
+def read_sessions(*csv_paths):
+    with preprocess_data(*csv_paths) as sessions:
+        contents = []
+        for session in sessions:
+            with open_csv(session) as fh:
+                contents.append(fh.read())
+        return contents
+
+
+def test_preprocess_plain(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    csv_path.write_text(TWO_SESSIONS)
+
+    sessions = read_sessions(csv_path)
+    assert len(sessions) == 2
+    assert sessions[0].startswith(HEADER)
+    assert sessions[1].startswith(HEADER)
+    assert sessions[0].count('\n') == 4
+    assert sessions[1].count('\n') == 3
+
+    # torque's infinity symbol gets replaced
+    assert '∞' not in sessions[0]
+    assert ',inf,' in sessions[0]
+
+
+def test_preprocess_no_header(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    csv_path.write_text(''.join(ROWS) + HEADER + ''.join(ROWS))
+
+    # data before the first header is still its own session
+    sessions = read_sessions(csv_path)
+    assert len(sessions) == 2
+    assert sessions[0] == ''.join(ROWS).replace('∞', 'inf')
+
+
+@pytest.mark.parametrize('suffix, opener', [('.gz', gzip.open), ('.bz2', bz2.open), ('.xz', lzma.open)])
+def test_preprocess_compressed(tmp_path, suffix, opener):
+    plain_path = tmp_path / 'log.csv'
+    plain_path.write_text(TWO_SESSIONS)
+
+    csv_path = tmp_path / f'log.csv{suffix}'
+    with opener(csv_path, 'wt') as fh:
+        fh.write(TWO_SESSIONS)
+
+    assert read_sessions(csv_path) == read_sessions(plain_path)
+    # sessions from compressed files are kept compressed
+    with preprocess_data(csv_path) as sessions:
+        assert all(detect_compression(session) == 'gzip' for session in sessions)
+
+    # without the extension we should still recognize the file
+    unnamed_path = csv_path.rename(tmp_path / 'log.dat')
+    assert read_sessions(unnamed_path) == read_sessions(plain_path)
+
+
+def test_preprocess_zip(tmp_path):
+    archive_path = tmp_path / 'logs.zip'
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('trip1.csv', TWO_SESSIONS)
+        archive.writestr('trip2.csv', HEADER + ''.join(ROWS))
+
+    # every file in the archive should be read, as though each was its own csv_path
+    sessions = read_sessions(archive_path)
+    assert len(sessions) == 3
+    assert sessions[:2] == read_sessions(ZipMember(archive_path, 'trip1.csv'))
+    assert sessions[2] == read_sessions(ZipMember(archive_path, 'trip2.csv'))[0]
+
+
+def test_load_streamed(tmp_path, monkeypatch):
+    csv_path = tmp_path / 'log.csv.gz'
+    with gzip.open(csv_path, 'wt') as fh:
+        fh.write(TWO_SESSIONS)
+
+    # sessions are read straight from the compressed file, without splitting it into temporary files
+    monkeypatch.setattr('tempfile.mkdtemp', None)
+    config = dict(csv_path=[csv_path], read_csv=dict(skipinitialspace=True))
+    assert len(load_from_csv(dict(config))) == 5
+
+    second = load_from_csv(dict(config, session=1))
+    assert len(second) == 2
+    assert list(second.columns) == [column.strip() for column in HEADER.split(',')]
+    assert second['Speed (OBD)(km/h)'].tolist() == [0.0, 1.5]
+
+    # sessions can be counted from the end
+    last = load_from_csv(dict(config, session=-1))
+    assert last['Speed (OBD)(km/h)'].tolist() == [0.0, 1.5]
+    assert len(load_from_csv(dict(config, session=-2))) == 3
+
+    for missing in (2, -3):
+        with pytest.raises(ValueError):
+            load_from_csv(dict(config, session=missing))
+
+
+def test_detect_compression(tmp_path):
+    plain_path = tmp_path / 'log.csv'
+    plain_path.write_text(TWO_SESSIONS)
+    assert detect_compression(plain_path) is None
+
+    assert detect_compression(tmp_path / 'log.csv.gz') == 'gzip'
+    assert detect_compression(tmp_path / 'log.csv.xz') == 'xz'
+    assert detect_compression(tmp_path / 'log.ZIP') == 'zip'
+
+    gzip_path = tmp_path / 'log'
+    gzip_path.write_bytes(gzip.compress(TWO_SESSIONS.encode()))
+    assert detect_compression(gzip_path) == 'gzip'
+
+
+def test_preview(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        fh.write(HEADER)
+        for index in range(10000):
+            fh.write(f"Wed Oct 18 08:12:45 PDT 2023,18-Oct-2023 08:12:45.000,-122.3301,47.6062,{index},0.0\n")
+        # a second session with more columns
+        fh.write(HEADER.strip() + ", Extra\n")
+        for index in range(10000, 20000):
+            fh.write(f"Wed Oct 18 08:12:45 PDT 2023,18-Oct-2023 08:12:45.000,-122.3301,47.6062,{index},0.0,1\n")
+
+    with preprocess_data(csv_path, preview=1000) as sessions:
+        csv_dataframe = pandas.concat([pandas.read_csv(session, skipinitialspace=True) for session in sessions])
+
+    # evenly spaced samples from the whole file, and only rows that match the header before them
+    rpm = csv_dataframe['Engine RPM(rpm)']
+    assert 900 <= len(csv_dataframe) <= 1000
+    assert rpm.iloc[0] == 0 and rpm.max() > 19000
+    assert rpm.is_monotonic_increasing
+    assert csv_dataframe['Extra'].isna().sum() == (rpm < 10000).sum()
+
+    # small files are read in full
+    with preprocess_data(csv_path, preview=100000) as sessions:
+        assert sum(len(pandas.read_csv(session)) for session in sessions) == 20000
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.dataset """
+import numpy as np
+import pytest
+
+from cdplot.config import process_config
+from cdplot.data import preprocess_data
+from cdplot.dataset import Dataset, augment_session
+
+HEADER = "Device Time, Engine RPM(rpm), Speed (OBD)(km/h), Fuel flow rate/hour(l/hr)\n"
+
+
+def test_render_figures(tmp_path):
+    # the integral filter needs scipy
+    pytest.importorskip('scipy')
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        fh.write(HEADER)
+        for index in range(20):
+            fh.write(f"18-Oct-2023 08:12:{index:02d}.000,{1000 + index},{index},{index / 10}\n")
+
+    dataset = Dataset.from_csv(csv_path, x='Device Time')
+    dataset.config['data']['filters'] = [dict(source='Fuel flow rate/hour(l/hr)', destination='Fuel used',
+                                              type='integral')]
+    dataset.config['plots'] = [
+        dict(output_path=tmp_path / 'engine.html', y=['Engine RPM(rpm)', 'Speed (OBD)(km/h)'], title='Engine'),
+        dict(output_path=tmp_path / 'fuel.html', include=['Fuel used']),
+        dict(output_path=tmp_path / 'density.html', type='density', x='Speed (OBD)(km/h)', y=['Engine RPM(rpm)']),
+        dict(output_path=tmp_path / 'all.html', title='Everything'),
+    ]
+    figures = dataset.render_figures(workers=2)
+
+    assert [config['output_path'].name for config, _ in figures] == ['engine.html', 'fuel.html', 'density.html',
+                                                                      'all.html']
+    engine, fuel, density, everything = [fig for _, fig in figures]
+    assert [trace.name for trace in engine.data] == ['Engine RPM(rpm)', 'Speed (OBD)(km/h)']
+    assert engine.layout.title.text == 'Engine'
+    assert [trace.name for trace in fuel.data] == ['Fuel used']
+    assert np.isclose(fuel.data[0].y[-1], sum(index / 10 for index in range(1, 20)) / 3600)
+    assert density.data[0].type == 'heatmap'
+
+    # a section without any y or include plots the same columns as the plain plot, without the integral's intermediates
+    assert [trace.name for trace in everything.data] == [trace.name for trace in dataset.render().data]
+    assert [trace.name for trace in everything.data] == ['Engine RPM(rpm)', 'Speed (OBD)(km/h)',
+                                                         'Fuel flow rate/hour(l/hr)', 'Fuel used']
+
+    # the integral's operations were only computed once, for all of the sections
+    assert len(dataset._results) == len(figures[0][0]['data']['_operations']) == 4
+
+
+def test_augment_session(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        fh.write(HEADER)
+        for index in range(5):
+            fh.write(f"18-Oct-2023 08:12:{index:02d}.000,{1000 + index},{index},{index / 10}\n")
+        # a session without the fuel column
+        fh.write("Device Time, Engine RPM(rpm), Speed (OBD)(km/h)\n")
+        fh.write("18-Oct-2023 09:00:00.000,800,0\n")
+
+    config = process_config(csv_path=str(csv_path), x='Device Time', workers=4)
+    config['data']['include'] = ['Engine RPM(rpm)']
+    config['data']['require'].append('Fuel flow rate/hour(l/hr)')
+    with preprocess_data(csv_path) as sessions:
+        first, second = [augment_session(session, config) for session in sessions]
+
+    assert len(first) == 5
+    assert first.columns == ['Device Time', 'Engine RPM(rpm)', 'Fuel flow rate/hour(l/hr)']
+    # sessions that don't have the columns the config needs are skipped
+    assert second is None
+    # and the config passed in is left alone
+    assert config['data']['workers'] == 4
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.export """
+import numpy as np
+import pandas
+import pytest
+
+from cdplot.config import process_config
+from cdplot.export import export
+
+HEADER = "Device Time, Engine RPM(rpm), Fuel flow rate/hour(l/hr)\n"
+
+
+@pytest.fixture
+def config(tmp_path):
+    # the integral filter needs scipy
+    pytest.importorskip('scipy')
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        for session in range(2):
+            fh.write(HEADER)
+            for index in range(10):
+                fh.write(f"18-Oct-2023 0{session}:00:{index:02d}.000,{1000 * (session + 1) + index},3600\n")
+
+    config = process_config(csv_path=str(csv_path), x='Device Time', workers=2)
+    config['data']['filters'] = [dict(source='Fuel flow rate/hour(l/hr)', destination='Fuel used', type='integral')]
+    return config
+
+
+def test_export_npz(config, tmp_path):
+    config['export'] = dict(output_path=tmp_path / 'trip.npz')
+    assert export(config) == [tmp_path / 'trip.npz']
+
+    with np.load(tmp_path / 'trip.npz') as data:
+        assert list(data) == ['Device Time', 'Engine RPM(rpm)', 'Fuel flow rate/hour(l/hr)', 'Fuel used']
+        assert data['Device Time'].dtype.kind == 'M'
+        assert len(data['Engine RPM(rpm)']) == 20
+        # a litre a second for 9 seconds
+        assert np.isclose(data['Fuel used'][9], 9)
+
+
+def test_export_sessions(config, tmp_path):
+    config['export'] = dict(output_path=tmp_path / 'session_{session}.csv')
+    assert export(config) == [tmp_path / 'session_0.csv', tmp_path / 'session_1.csv']
+
+    session = pandas.read_csv(tmp_path / 'session_1.csv')
+    assert list(session['Engine RPM(rpm)']) == list(range(2000, 2010))
+    assert np.isclose(session['Fuel used'].iloc[-1], 9)
+
+
+def test_export_parquet(config, tmp_path):
+    pytest.importorskip('pyarrow')
+    config['export'] = dict(output_path=tmp_path / 'trip.parquet')
+    export(config)
+    assert list(pandas.read_parquet(tmp_path / 'trip.parquet')['Engine RPM(rpm)'][:2]) == [1000, 1001]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.filters """
+import numpy as np
+import pandas
+import pytest
+
+from cdplot.columns import ColumnStore
+from cdplot.exceptions import PlotTorqueProException
+from cdplot.filters import (Operation, choose_convolution_method, convolve, process_data, schedule_operations,
+                            valid_runs)
+
+
+def make_operations(*op_configs):
+    return [Operation(dict(op_config)) for op_config in op_configs]
+
+
+def test_operation_key():
+    # the output name doesn't matter, only what's computed
+    op1, op2 = make_operations(dict(source='a', destination='b', type='product', constant=2),
+                               dict(source='a', destination='c', type='product', constant=2))
+    assert op1.key() == op2.key()
+
+    op3, = make_operations(dict(source='a', destination='b', type='product', constant=3))
+    assert op1.key() != op3.key()
+
+    # the same operation on differently computed inputs is a different operation
+    assert op1.key() != op1.key(producers={'a': op3.key()})
+
+
+def test_process_data_results():
+    dataframe = pandas.DataFrame(dict(a=np.arange(5.0), b=np.ones(5)))
+    operations = make_operations(dict(source='a', destination='tmp', type='sum', column='b'),
+                                 dict(source='tmp', destination='out', type='product', constant=2))
+    results = {}
+    process_data(dataframe, operations, results)
+    assert len(results) == 2
+    assert list(dataframe['out']) == [2, 4, 6, 8, 10]
+
+    # remembered results are used in place of running the operation again
+    key = operations[-1].key({'tmp': operations[0].key()})
+    results[key] = pandas.Series(np.zeros(5))
+    process_data(dataframe, operations, results)
+    assert list(dataframe['out']) == [0, 0, 0, 0, 0]
+
+
+def test_process_data_column_store():
+    dataframe = pandas.DataFrame(dict(a=np.arange(5.0), b=np.ones(5)))
+    store = ColumnStore.from_dataframe(dataframe)
+    operations = make_operations(dict(source='a', destination='tmp', type='sum', column='b'),
+                                 dict(source='tmp', destination='out', type='difference', align='right'))
+    process_data(store, operations)
+    assert store.columns == ['a', 'b', 'tmp', 'out']
+    assert list(store['out']) == [0, 1, 1, 1, 1]
+
+    # the original DataFrame isn't touched, and selecting columns shares the arrays
+    assert list(dataframe.columns) == ['a', 'b']
+    assert store.select(['out'])['out'] is store['out']
+
+
+def test_convolve_alignment():
+    values = np.arange(10.0)
+    window = np.ones(3) / 3
+
+    # centered by default, and always the same length as the input
+    centered = convolve(values, window)
+    assert len(centered) == len(values)
+    assert np.allclose(centered[1:-1], values[1:-1])
+
+    # offset=0 is a trailing average
+    trailing = convolve(values, window, offset=0)
+    assert np.allclose(trailing[2:], values[1:-1])
+
+    # shifting past the end of the convolution pads with zeros
+    shifted = convolve(values, window, offset=len(values))
+    assert len(shifted) == len(values)
+    assert np.allclose(shifted[3:], 0)
+
+
+def test_convolve_methods():
+    pytest.importorskip('scipy')
+    values = np.random.default_rng(0).normal(size=20000)
+    window = np.hanning(501)
+    exact = convolve(values, window, method='direct')
+
+    for method in ('fft', 'overlap-add', 'auto'):
+        assert np.allclose(convolve(values, window, method=method), exact)
+
+    # short windows are always computed exactly
+    assert choose_convolution_method(len(values), 5) == 'direct'
+    assert choose_convolution_method(10**6, 5000) == 'overlap-add'
+    assert choose_convolution_method(10**4, 5000) == 'fft'
+
+
+def test_convolve_nan():
+    pytest.importorskip('scipy')
+    values = np.random.default_rng(0).normal(size=20000)
+    values[[100, 10000, 19990]] = np.nan
+    window = np.hanning(501)
+    exact = convolve(values, window, method='direct')
+    assert 0 < np.isnan(exact).sum() < 2000
+
+    # every method only spoils the outputs whose window covers a NaN
+    for method in ('fft', 'overlap-add', 'auto'):
+        for offset in (None, 0, 600):
+            output = convolve(values, window, offset=offset, method=method)
+            expected = convolve(values, window, offset=offset, method='direct')
+            assert np.array_equal(np.isnan(output), np.isnan(expected))
+            assert np.allclose(output, expected, equal_nan=True)
+
+
+def test_lfilter_without_scipy(monkeypatch):
+    monkeypatch.setattr('cdplot.filters.SCIPY_AVAILABLE', False)
+    with pytest.raises(PlotTorqueProException):
+        make_operations(dict(source='a', destination='b', type='lfilter',
+                             coefficients=dict(numerator=[1], denominator=[1, -1])))
+
+
+def test_average_operation():
+    dataframe = pandas.DataFrame(dict(a=np.arange(10.0)))
+    operation, = make_operations(dict(source='a', destination='b', type='convolution', window=4, offset=3))
+    operation(dataframe)
+
+    # a number of coefficients is a moving average that long
+    assert len(dataframe['b']) == 10
+    assert np.allclose(dataframe['b'][:7], np.arange(10.0)[:7] + 1.5)
+
+
+def test_valid_runs():
+    values = np.array([np.nan, 1, 2, np.nan, 3, np.nan, np.nan, np.nan, 4, 5])
+    starts, stops = valid_runs(values)
+    assert list(starts) == [1, 4, 8] and list(stops) == [3, 5, 10]
+
+    # runs a single NaN apart are joined
+    starts, stops = valid_runs(values, max_gap=1)
+    assert list(starts) == [1, 8] and list(stops) == [5, 10]
+
+
+def test_segmented_filter():
+    pytest.importorskip('scipy')
+    values = np.array([1, 1, np.nan, 1, 1, 1, np.nan, np.nan, 1])
+    dataframe = pandas.DataFrame(dict(a=values))
+    coefficients = dict(numerator=[1], denominator=[1, -1])
+    propagate, segment, bridged = make_operations(
+        dict(source='a', destination='b', type='lfilter', coefficients=coefficients),
+        dict(source='a', destination='c', type='lfilter', coefficients=coefficients, nan='segment'),
+        dict(source='a', destination='d', type='lfilter', coefficients=coefficients, nan='segment', max_gap=1))
+    for operation in (propagate, segment, bridged):
+        operation(dataframe)
+
+    # a NaN makes the rest of an ordinary filter NaN
+    assert np.isnan(dataframe['b'][2:]).all()
+    # each run is filtered on its own, and NaNs stay where they were
+    assert np.allclose(dataframe['c'], [1, 2, np.nan, 1, 2, 3, np.nan, np.nan, 1], equal_nan=True)
+    # the sum carries across the single NaN, but not the longer gap
+    assert np.allclose(dataframe['d'], [1, 2, np.nan, 3, 4, 5, np.nan, np.nan, 1], equal_nan=True)
+
+    # the rows of the frame aren't touched
+    assert len(dataframe) == len(values) and np.isnan(dataframe['a'][2])
+
+
+def test_schedule_operations():
+    operations = make_operations(dict(source='a', destination='a2', type='product', constant=2),
+                                 dict(source='b', destination='b2', type='product', constant=2),
+                                 dict(source='a2', destination='a3', type='sum', column='b2'),
+                                 dict(source='c', destination='c', type='product', constant=2),
+                                 dict(source='a2', destination='a2', type='product', constant=2))
+    stages = schedule_operations(operations)
+
+    # independent operations share a stage, and dependents come after what they depend on
+    assert stages == [operations[:2] + [operations[3]], [operations[2], operations[4]]]
+
+
+def test_process_data_workers():
+    dataframe = pandas.DataFrame({name: np.arange(5.0) for name in 'abc'})
+    operations = make_operations(*[dict(source=name, destination=f'{name}2', type='product', constant=2)
+                                   for name in 'abc'],
+                                 dict(source='a2', destination='out', type='sum', column='c2'))
+
+    serial = process_data(dataframe.copy(), operations, workers=1)
+    parallel = process_data(dataframe.copy(), operations, workers=4)
+    assert list(parallel.columns) == list(serial.columns)
+    assert list(parallel['out']) == [0, 4, 8, 12, 16]
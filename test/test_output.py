@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.output """
+import base64
+import io
+import json
+import re
+
+import numpy as np
+import pandas
+
+from cdplot.columns import ColumnStore
+from cdplot.output import TYPED_ARRAY_DTYPES, write_html, write_json
+from cdplot.plot import render_plot
+
+
+def make_figure(n_columns=3):
+    columns = {'Device Time': pandas.date_range('2023-10-18 08:12:45', periods=100, freq='500ms').to_numpy()}
+    columns.update({f'PID {index}': np.arange(100.0) * index for index in range(n_columns)})
+    return render_plot(ColumnStore(columns), dict(x='Device Time'))
+
+
+def decode(spec):
+    dtypes = {short_name: dtype for dtype, short_name in TYPED_ARRAY_DTYPES.items()}
+    return np.frombuffer(base64.b64decode(spec['bdata']), dtype=dtypes[spec['dtype']])
+
+
+def test_write_html_shared_x(tmp_path):
+    output_path = tmp_path / 'figure.html'
+    write_html(make_figure(), output_path, include_plotlyjs=False)
+    html = output_path.read_text()
+
+    # every trace has the same x-axis, so it's only written once
+    shared_x = re.findall(r'sharedX\.push\(decode\((.*)\)\);', html)
+    traces = [json.loads(trace) for trace in re.findall(r'data\.push\(decodeAll\((.*)\)\);', html)]
+    assert len(shared_x) == 1
+    assert len(traces) == 3
+    assert all('x' not in trace for trace in traces)
+    assert '[0, 0, 0].forEach' in html
+
+    # timestamps are milliseconds since the epoch, on a date axis
+    milliseconds = decode(json.loads(shared_x[0]))
+    assert milliseconds[1] - milliseconds[0] == 500
+    assert milliseconds[0] == pandas.Timestamp('2023-10-18 08:12:45').value / 1e6
+    layout = json.loads(re.search(r'var layout = decodeAll\((.*)\);', html).group(1))
+    assert layout['xaxis']['type'] == 'date'
+
+    # and y values are typed arrays
+    assert list(decode(traces[2]['y'])) == list(np.arange(100.0) * 2)
+
+
+def test_write_html_size(tmp_path):
+    sizes = []
+    for n_columns in (2, 4, 8):
+        output_path = tmp_path / f'{n_columns}.html'
+        write_html(make_figure(n_columns), output_path, include_plotlyjs=False)
+        sizes.append(output_path.stat().st_size)
+
+    # each y column is 100 doubles (about 1100 bytes of base64) plus the trace's attributes. Another copy of x as date
+    # strings would be about 3000 bytes more on top of that
+    per_column = (sizes[2] - sizes[1]) / 4
+    assert per_column < 2000
+    assert abs((sizes[1] - sizes[0]) / 2 - per_column) < 0.1 * per_column
+
+
+def test_write_json():
+    fh = io.StringIO()
+    write_json(fh, dict(a=np.arange(3, dtype=np.int64), b=[dict(c=np.ones((2, 2), dtype=np.float32))], d='</script>'))
+    value = json.loads(fh.getvalue())
+
+    # int64 isn't a typed array in plotly.js, so it's shrunk to fit
+    assert value['a']['dtype'] == 'i1'
+    assert list(decode(value['a'])) == [0, 1, 2]
+    assert value['b'][0]['c']['shape'] == '2, 2'
+    assert value['d'] == '</script>'
+    assert '</script>' not in fh.getvalue()
+
+
+def test_write_html_lazy(tmp_path):
+    fig = make_figure(4)
+    fig.for_each_trace(lambda trace: trace.update(visible='legendonly'), selector=lambda trace: trace.name != 'PID 1')
+    output_path = tmp_path / 'figure.html'
+    write_html(fig, output_path, include_plotlyjs=False, lazy=True)
+    html = output_path.read_text()
+
+    # only the visible trace's data is in the page. The hidden traces are placeholders until they're loaded
+    traces = [json.loads(trace) for trace in re.findall(r'data\.push\(decodeAll\((.*)\)\);', html)]
+    assert [trace['y'] == [None] for trace in traces] == [True, False, True, True]
+    lazy_traces = json.loads(re.search(r'var lazyTraces = (.*);', html).group(1))
+    assert lazy_traces == {str(index): f'figure_traces/trace_{index}.js' for index in (0, 2, 3)}
+
+    # and they share the x-axis that's already in the page
+    script = (tmp_path / 'figure_traces' / 'trace_3.js').read_text()
+    update = json.loads(re.search(r'\(3, (.*)\);', script).group(1))
+    assert list(update) == ['y']
+    assert list(decode(update['y'])) == list(np.arange(100.0) * 3)
+
+    # without lazy, everything is in the page
+    write_html(fig, tmp_path / 'eager.html', include_plotlyjs=False)
+    assert 'lazyTraces' not in (tmp_path / 'eager.html').read_text()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.overlay """
+import numpy as np
+
+from cdplot.config import process_config
+from cdplot.overlay import decimate, overlay
+
+HEADER = "Device Time, Longitude, Latitude, Engine RPM(rpm)\n"
+
+
+def test_decimate():
+    x_values = np.arange(1000.0)
+    y_values = np.sin(x_values / 10)
+    y_values[500] = 5
+    y_values[600:700] = np.nan
+
+    decimated_x, decimated_y = decimate(x_values, y_values, 100)
+    assert len(decimated_x) <= 100
+    assert np.all(np.diff(decimated_x) > 0)
+    # the peak survives, and empty buckets are dropped
+    assert decimated_y.max() == 5
+    assert not np.isnan(decimated_y).any()
+
+    # short sessions are left alone
+    assert len(decimate(x_values[:10], y_values[:10], 100)[0]) == 10
+
+
+def test_overlay(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        for session in range(3):
+            fh.write(HEADER)
+            for index in range(10 * (session + 1)):
+                fh.write(f"2023-10-18 0{session}:00:{index:02d},-122.33,47.60,{1000 * (session + 1) + index}\n")
+
+    config = process_config(csv_path=str(csv_path), x='Device Time', workers=2,
+                            read_csv=dict(parse_dates=['Device Time']))
+    config['overlay'] = dict(y='Engine RPM(rpm)')
+    fig = overlay(config)
+
+    assert [trace.name for trace in fig.data] == ['session 0', 'session 1', 'session 2']
+    # every session starts at 0 seconds
+    assert [trace.x[0] for trace in fig.data] == [0, 0, 0]
+    assert [trace.x[-1] for trace in fig.data] == [9, 19, 29]
+    assert list(fig.data[1].y[:2]) == [2000, 2001]
+
+    config['overlay'] = dict(y='Engine RPM(rpm)', align='Engine RPM(rpm)')
+    fig = overlay(config)
+    assert list(fig.data[2].x[:3]) == [0, 1, 2]
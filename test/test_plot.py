@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.plot """
+import numpy as np
+import pandas
+import pytest
+
+from cdplot.columns import ColumnStore
+from cdplot.exceptions import PlotTorqueProException
+from cdplot.plot import render_plot
+
+
+def make_data(rows=10000):
+    rng = np.random.default_rng(0)
+    speed = rng.uniform(0, 120, rows)
+    return ColumnStore({
+        'Device Time': pandas.date_range('2023-10-18 08:12:45', periods=rows, freq='100ms').to_numpy(),
+        'Speed (OBD)(km/h)': speed,
+        'Engine RPM(rpm)': speed * 30 + rng.normal(0, 100, rows),
+        'Throttle Position(%)': rng.uniform(0, 100, rows),
+    })
+
+
+def test_density_plot():
+    fig = render_plot(make_data(), dict(type='density', x='Speed (OBD)(km/h)', y=['Engine RPM(rpm)'], bins=[20, 10]))
+
+    assert len(fig.data) == 1
+    heatmap = fig.data[0]
+    assert heatmap.type == 'heatmap'
+    assert heatmap.z.shape == (10, 20)
+    assert np.nansum(heatmap.z) == 10000
+    assert len(heatmap.x) == 20 and heatmap.x[0] < heatmap.x[1]
+    # RPM follows speed, so the top left and bottom right corners are empty
+    assert np.isnan(heatmap.z[-1, 0]) and np.isnan(heatmap.z[0, -1])
+
+
+def test_density_plot_infinite():
+    data = make_data()
+    speed = data['Speed (OBD)(km/h)'].copy()
+    speed[5] = np.inf
+    data['Speed (OBD)(km/h)'] = speed
+
+    # infinite rows are left out, rather than stretching the bins so that everything else lands in one of them
+    fig = render_plot(data, dict(type='density', x='Speed (OBD)(km/h)', y=['Engine RPM(rpm)'], bins=[20, 10]))
+    heatmap = fig.data[0]
+    assert np.nansum(heatmap.z) == 9999
+    assert np.isfinite(heatmap.x).all()
+    assert np.sum(~np.isnan(heatmap.z)) > 20
+
+
+def test_density_plot_aggregate():
+    data = make_data()
+    fig = render_plot(data, dict(type='density', x='Speed (OBD)(km/h)', y=['Engine RPM(rpm)'], bins=1,
+                                 z='Throttle Position(%)', aggregate='max'))
+    assert fig.data[0].z[0, 0] == data['Throttle Position(%)'].max()
+
+    fig = render_plot(data, dict(type='density', x='Speed (OBD)(km/h)', y=['Engine RPM(rpm)'], bins=1,
+                                 z='Throttle Position(%)'))
+    assert np.isclose(fig.data[0].z[0, 0], data['Throttle Position(%)'].mean())
+
+    fig = render_plot(data, dict(type='density', x='Device Time', y=['Speed (OBD)(km/h)'], bins=[10], log=True))
+    assert fig.data[0].x.dtype.kind == 'M'
+    assert np.isclose(np.nansum(10 ** fig.data[0].z), 10000)
+
+
+def test_density_plot_needs_one_y():
+    with pytest.raises(PlotTorqueProException):
+        render_plot(make_data(), dict(type='density', x='Speed (OBD)(km/h)'))
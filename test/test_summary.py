@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.summary """
+import numpy as np
+import pandas
+
+from cdplot.config import process_config
+from cdplot.summary import session_statistics, summarize
+
+HEADER = "Device Time, Longitude, Latitude, Engine RPM(rpm)\n"
+
+
+def test_session_statistics():
+    values = np.array([[1.0, np.nan], [2.0, np.nan], [3.0, np.nan], [np.nan, np.nan]])
+    results = session_statistics(values, ['count', 'min', 'mean', 'p50'])
+
+    assert list(results) == ['count', 'min', 'mean', 'p50']
+    assert list(results['count']) == [3, 0]
+    assert results['min'][0] == 1
+    assert results['mean'][0] == 2
+    assert results['p50'][0] == 2
+
+    # a column without any values just gets NaN
+    assert np.isnan(results['mean'][1])
+
+
+def test_summarize(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    with csv_path.open('w') as fh:
+        for session in range(3):
+            fh.write(HEADER)
+            for index in range(10):
+                fh.write(f"2023-10-18 0{session}:00:{index:02d},-122.33,47.60,{1000 * (session + 1) + index}\n")
+
+    config = process_config(csv_path=str(csv_path), x='Device Time', workers=2,
+                            read_csv=dict(parse_dates=['Device Time']))
+    config['summary'] = dict(output_path=tmp_path / 'summary.csv', statistics=['min', 'max', 'mean'])
+    table = summarize(config)
+
+    assert list(table['session']) == [0, 1, 2]
+    assert list(table['rows']) == [10, 10, 10]
+    assert list(table['duration_s']) == [9, 9, 9]
+    assert list(table['Engine RPM(rpm) min']) == [1000, 2000, 3000]
+    assert list(table['Engine RPM(rpm) mean']) == [1004.5, 2004.5, 3004.5]
+
+    written = pandas.read_csv(tmp_path / 'summary.csv')
+    assert list(written['Engine RPM(rpm) max']) == [1009, 2009, 3009]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.timestamps """
+import numpy as np
+import pandas
+
+from cdplot.timestamps import parse_timestamp_column, parse_timestamps
+
+
+def test_parse_timestamps():
+    csv_dataframe = pandas.DataFrame({
+        'GPS Time': ['Wed Oct 18 08:12:45 PDT 2023', None, 'Wed Oct 18 08:12:46 GMT+01:00 2023'],
+        'Device Time': ['18-Oct-2023 08:12:45.000', '18-Oct-2023 08:12:45.500', '31-Dec-2023 23:59:59.999'],
+        'Engine RPM(rpm)': [1000.0, 1001.0, 1002.0],
+    })
+    parse_timestamps(csv_dataframe, {})
+
+    assert list(csv_dataframe['Device Time']) == list(pandas.to_datetime(
+        ['2023-10-18 08:12:45.000', '2023-10-18 08:12:45.500', '2023-12-31 23:59:59.999']))
+    # times with a zone are converted to UTC
+    assert csv_dataframe['GPS Time'][0] == pandas.Timestamp('2023-10-18 15:12:45')
+    assert pandas.isna(csv_dataframe['GPS Time'][1])
+    assert csv_dataframe['GPS Time'][2] == pandas.Timestamp('2023-10-18 07:12:46')
+    assert csv_dataframe['Engine RPM(rpm)'].dtype == np.float64
+
+
+def test_parse_time_zones():
+    # the end of daylight saving time, where the local time goes backwards
+    timestamps = parse_timestamp_column(pandas.Series(['Sun Nov 05 01:30:00 PDT 2023', 'Sun Nov 05 01:10:00 PST 2023',
+                                                       'Sun Nov 05 01:40:00 GMT-08:00 2023']))
+    assert list(timestamps) == list(pandas.to_datetime(['2023-11-05 08:30', '2023-11-05 09:10', '2023-11-05 09:40']))
+
+    # a zone that isn't known is left as it is, unless it changes
+    unknown = parse_timestamp_column(pandas.Series(['Sun Nov 05 01:30:00 XYZ 2023']))
+    assert unknown[0] == pandas.Timestamp('2023-11-05 01:30')
+    changing = pandas.Series(['Sun Nov 05 01:30:00 XYZ 2023', 'Sun Nov 05 01:10:00 PST 2023'])
+    assert parse_timestamp_column(changing) is None
+
+
+def test_parse_timestamp_column():
+    # epoch seconds and milliseconds
+    expected = pandas.Timestamp('2023-10-18 08:12:45')
+    assert parse_timestamp_column(pandas.Series([expected.timestamp()]))[0] == expected
+    assert parse_timestamp_column(pandas.Series([expected.timestamp() * 1000]))[0] == expected
+
+    # a configured format
+    assert parse_timestamp_column(pandas.Series(['2023/10/18 08:12:45']), '%Y/%m/%d %H:%M:%S')[0] == expected
+
+    # anything else is left alone
+    assert parse_timestamp_column(pandas.Series(['18-Foo-2023 08:12:45.000'])) is None
+    assert parse_timestamp_column(pandas.Series(['yesterday'])) is None
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+""" Unit tests for plot_torque_pro.watch """
+import os
+import re
+
+from cdplot.watch import Watcher
+
+HEADER = "Device Time, Longitude, Latitude, Engine RPM(rpm), Speed (OBD)(km/h)\n"
+CONFIG = """
+[plot_torque_pro]
+output_path = "{output_path}"
+[plot_torque_pro.data]
+csv_path = "{csv_path}"
+[[plot_torque_pro.data.filters]]
+source = "Engine RPM(rpm)"
+destination = "Smooth RPM"
+type = "average"
+coefficients = {window}
+[plot_torque_pro.plot]
+x = "Device Time"
+y = {y}
+"""
+
+
+def write_config(config_path, tmp_path, version, window=3, y='["Smooth RPM"]'):
+    config_path.write_text(CONFIG.format(output_path=tmp_path / 'plot.html', csv_path=tmp_path / 'log.csv',
+                                         window=window, y=y))
+    # make sure the change is noticed, however coarse the filesystem's timestamps are
+    os.utime(config_path, (version, version))
+
+
+def traces(tmp_path):
+    return len(re.findall(r'^    data\.push\(', (tmp_path / 'plot.html').read_text(), re.MULTILINE))
+
+
+def test_watcher(tmp_path):
+    with (tmp_path / 'log.csv').open('w') as fh:
+        fh.write(HEADER)
+        for index in range(20):
+            fh.write(f"2023-10-18 08:00:{index:02d},-122.33,47.60,{1000 + index},{index}\n")
+
+    config_path = tmp_path / 'plot.toml'
+    write_config(config_path, tmp_path, 1)
+    watcher = Watcher(config_path)
+    assert watcher.update()
+    assert traces(tmp_path) == 1
+    dataset = watcher.dataset
+
+    # nothing changed
+    assert not watcher.update()
+
+    # a plot change doesn't read the csv again, or rerun the filter
+    results = dict(dataset._results)
+    write_config(config_path, tmp_path, 2, y='["Smooth RPM", "Speed (OBD)(km/h)"]')
+    assert watcher.update()
+    assert watcher.dataset is dataset
+    assert traces(tmp_path) == 2
+    assert all(dataset._results[key] is value for key, value in results.items())
+
+    # a filter change only computes the new filter's output, and the old output is forgotten
+    write_config(config_path, tmp_path, 3, window=5)
+    assert watcher.update()
+    assert watcher.dataset is dataset
+    assert len(dataset._results) == len(results)
+    assert not set(dataset._results) & set(results)
+
+    # and a csv change reads the csv again
+    with (tmp_path / 'log.csv').open('a') as fh:
+        fh.write("2023-10-18 08:00:20,-122.33,47.60,1020,20\n")
+    assert watcher.update()
+    assert watcher.dataset is not dataset
+    assert len(watcher.dataset.data) == 21